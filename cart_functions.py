@@ -1,19 +1,127 @@
-from tinydb import TinyDB, Query
-from helper_functions import generate_product_uri
-from user_functions import get_user
+from database import users, flush
+from migrations import carts_to_quantities
+from user_functions import get_user, update_user
+from product_functions import lookup_product, get_products_by_ids
 
-users = TinyDB('db.json').table('users')
-products = TinyDB('db.json').table('products')
 
+def migrate_carts():
+    """
+    Convert the carts stored as a list holding one product ID per unit
+    to a *dict* mapping each product ID to its quantity, see
+    :func:`migrations.carts_to_quantities`. All the carts are converted in
+    a single update. Carts already stored as a *dict* are left untouched.
+
+    :returns: Number of carts converted
+    :rtype: *int*
+
+    """
+
+    doc_ids = [user.doc_id for user in users if isinstance(user['cart'], list)]
+    if doc_ids:
+        users.update(lambda user: carts_to_quantities('users', user), doc_ids=doc_ids)
+        flush()
+
+    return len(doc_ids)
+
+
+def change_quantity(product_id, quantity):
+    """
+    Create a transform changing the quantity of a product in a user's cart,
+    to be passed to :func:`user_functions.update_user`. The product is
+    dropped from the cart once its quantity reaches zero.
+
+    :param str product_id: ID of the product
+    :param int quantity: Quantity to add, negative to remove units
+
+    :returns: A function modifying a user's document in place
+
+    """
+
+    def transform(user):
+        new_quantity = user['cart'].get(product_id, 0) + quantity
+        if new_quantity > 0:
+            user['cart'][product_id] = new_quantity
+        else:
+            user['cart'].pop(product_id, None)
 
-def add_product_to_cart(uname, product_id):
+    return transform
+
+
+def validate_quantity(quantity):
+    """
+    Check that a quantity of units to add to or remove from a cart is valid.
+
+    :param quantity: Quantity sent by the client
+
+    :returns: Message explaining why the quantity is invalid, *None* if it is valid
+    :rtype: *str*
+
+    """
+
+    if not isinstance(quantity, int) or quantity <= 0:
+        return "Quantity has to be a positive number"
+
+    return None
+
+
+def validate_cart_operation(operation):
     """
-    Add the product with *product_id* to the given user's cart.
+    Check that an operation to apply to a cart with :func:`apply_cart_operations` is valid.
+
+    :param dict operation: Operation sent by the client
+
+    :returns: Message explaining why the operation is invalid, *None* if it is valid
+    :rtype: *str*
+
+    """
+
+    if not isinstance(operation, dict):
+        return "Operation has to be a JSON object"
+
+    if operation.get('op') not in ('add', 'remove'):
+        return "Operation has to be either add or remove"
+
+    if not operation.get('product_id'):
+        return "Product ID is missing"
+
+    return validate_quantity(operation.get('quantity', 1))
+
+
+def apply_cart_operations(uname, operations):
+    """
+    Add and remove units of products to and from the given user's cart in
+    one update. The operations are applied in order, with the same effect
+    as the matching calls to :func:`add_product_to_cart` and
+    :func:`remove_product_from_cart`, and have to be valid according to
+    :func:`validate_cart_operation`.
+
+    :param str uname: Username
+    :param list operations: Operations, each with *op* set to *add* or *remove*, the *product_id* and an optional *quantity* defaulting to 1
+
+    :returns: The given user's cart after the operations, see :func:`get_user_cart`
+    :rtype: *dict*
+
+    """
+
+    def transform(user):
+        for operation in operations:
+            quantity = operation.get('quantity', 1)
+            change_quantity(operation['product_id'], quantity if operation['op'] == 'add' else -quantity)(user)
+
+    update_user(uname, transform)
+
+    return get_user_cart(uname)
+
+
+def add_product_to_cart(uname, product_id, quantity=1):
+    """
+    Add *quantity* units of the product with *product_id* to the given user's cart.
 
     :param str uname: Username
     :param str product_id: ID of the product to add to the user's cart
+    :param int quantity: Number of units to add
 
-    :returns: Username along with the product added to the cart
+    :returns: Username along with the product and the number of units added to the cart
     :rtype: *dict*
 
     - Example
@@ -25,33 +133,30 @@ def add_product_to_cart(uname, product_id):
             "product": {
                 "inventory_count": 51,
                 "price": 4.99,
-                "title": "Guava cupcake",
-                "uri": "http://localhost:5000/marketplace/api/product/a37b3418-cc8f-40fa-8d63-661b3912eb71"
-            }
+                "product_id": "a37b3418-cc8f-40fa-8d63-661b3912eb71",
+                "title": "Guava cupcake"
+            },
+            "quantity": 1
         }
 
     """
 
-    User_query = Query()
-    Product_query = Query()
-    current_user = users.get(User_query.username == uname)
-    current_user['cart'].append(product_id)
-
-    users.update({'cart': current_user['cart']}, User_query.username == uname)
+    update_user(uname, change_quantity(product_id, quantity))
 
-    return {'username': uname, 'product': products.get(Product_query.uri == generate_product_uri(product_id))}
+    return {'username': uname, 'product': lookup_product(product_id), 'quantity': quantity}
 
 
-def remove_product_from_cart(uname, product_id):
+def remove_product_from_cart(uname, product_id, quantity=1):
     """
-    Remove the product with *product_id* from the given user's cart.
-    If the product is not present in the cart anymore, an empty *dict*
-    is returned.
+    Remove *quantity* units of the product with *product_id* from the given
+    user's cart, or all of them if the cart holds fewer units. If the product
+    is not present in the cart anymore, an empty *dict* is returned.
 
     :param str uname: Username
     :param str product_id: Product to remove from user's cart
+    :param int quantity: Number of units to remove
 
-    :returns: Username along with the product removed from the cart
+    :returns: Username along with the product and the number of units removed from the cart
     :rtype: *dict*
 
     - Example
@@ -63,29 +168,28 @@ def remove_product_from_cart(uname, product_id):
             "product": {
                 "inventory_count": 51,
                 "price": 4.99,
-                "title": "Guava cupcake",
-                "uri": "http://localhost:5000/marketplace/api/product/a37b3418-cc8f-40fa-8d63-661b3912eb71"
-            }
+                "product_id": "a37b3418-cc8f-40fa-8d63-661b3912eb71",
+                "title": "Guava cupcake"
+            },
+            "quantity": 1
         }
 
     """
 
-    User_query = Query()
-    Product_query = Query()
-    current_user = users.get(User_query.username == uname)
-    if product_id in current_user['cart']:
-        current_user['cart'].remove(product_id)
-        users.update({'cart': current_user['cart']}, User_query.username == uname)
-
-    else:
+    quantity_in_cart = get_user(uname)['cart'].get(product_id, 0)
+    if not quantity_in_cart:
         return {}
 
-    return {'username': uname, 'product': products.get(Product_query.uri == generate_product_uri(product_id))}
+    quantity = min(quantity, quantity_in_cart)
+    update_user(uname, change_quantity(product_id, -quantity))
+
+    return {'username': uname, 'product': lookup_product(product_id), 'quantity': quantity}
 
 
 def get_user_cart(uname):
     """
-    Get the given user's cart.
+    Get the given user's cart. Products that were deleted from the database
+    after being added to the cart are left out.
 
     :param str uname: Username
 
@@ -101,14 +205,14 @@ def get_user_cart(uname):
                 {
                     "inventory_count": 12,
                     "price": 7.99,
-                    "title": "Orange cupcake",
-                    "uri": "http://localhost:5000/marketplace/api/product/f4ad5da8-2cc5-4ec0-86f3-4c02367c082f"
+                    "product_id": "f4ad5da8-2cc5-4ec0-86f3-4c02367c082f",
+                    "title": "Orange cupcake"
                 },
                 {
                     "inventory_count": 51,
                     "price": 4.99,
-                    "title": "Guava cupcake",
-                    "uri": "http://localhost:5000/marketplace/api/product/a37b3418-cc8f-40fa-8d63-661b3912eb71"
+                    "product_id": "a37b3418-cc8f-40fa-8d63-661b3912eb71",
+                    "title": "Guava cupcake"
                 }
             ],
             "total_price": 12.98
@@ -116,15 +220,19 @@ def get_user_cart(uname):
 
     """
 
-    User_query = Query()
-    Product_query = Query()
-    current_user_cart = users.get(User_query.username == uname)['cart']
+    current_user_cart = get_user(uname)['cart']
+
+    cart_products = get_products_by_ids(current_user_cart)
 
     cart = {'products': [], 'total_price': 0}
-    for product_id in current_user_cart:
-        cart_product = products.get(Product_query.uri == generate_product_uri(product_id))
-        cart['products'].append(cart_product)
-        cart['total_price'] += cart_product['price']
+    for product_id, quantity in current_user_cart.items():
+        cart_product = cart_products.get(product_id)
+        if not cart_product:
+            # The product was deleted from the database after being added
+            continue
+
+        cart['products'].extend([cart_product] * quantity)
+        cart['total_price'] += cart_product['price'] * quantity
 
     return cart
 
@@ -144,12 +252,14 @@ def clear_user_cart(uname):
 
         {
             "username": "Midoriya",
-            "user_cart": []
+            "user_cart": {}
         }
 
     """
 
-    User_query = Query()
-    users.update({'cart': []}, User_query.username == uname)
+    update_user(uname, {'cart': {}})
     affected_user = get_user(uname)
     return {'username': uname, 'user_cart': affected_user['cart']}
+
+
+migrate_carts()
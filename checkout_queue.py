@@ -0,0 +1,187 @@
+"""
+Asynchronous checkouts. Carts are validated and queued by the request
+threads, and completed by a pool of background worker threads, so that a
+request never waits for the inventories, the order and the cart to be
+written. Every queued checkout is also recorded in the database, along with
+the changes of the request queuing it, and is queued again when the server
+restarts before completing it. The statuses of the failed checkouts are
+only kept in memory, and are lost on restart.
+"""
+
+from collections import OrderedDict
+from queue import Queue, Full
+from threading import Lock, Thread
+from uuid import uuid4
+import config
+from database import db, flush
+from user_functions import get_user
+from order_functions import order_index, checkout, describe_checkout_failure
+
+checkout_jobs = Queue(maxsize=config.CHECKOUT_QUEUE_SIZE)
+# Checkouts queued and not completed yet, with the order ID, username and cart of each
+queued_checkouts = db.table('checkouts')
+# Status of the checkouts that are queued or being processed. Completed
+# checkouts are dropped since their order can be found in the database.
+checkout_statuses = {}
+# Status of the most recent failed checkouts, oldest first, see record_failed_checkout
+failed_checkouts = OrderedDict()
+failed_checkouts_lock = Lock()
+workers = []
+workers_lock = Lock()
+
+
+def start_checkout_workers():
+    """
+    Start the worker threads completing the queued checkouts, unless they
+    are already running.
+
+    :returns: Number of worker threads running
+    :rtype: *int*
+
+    """
+
+    with workers_lock:
+        while len(workers) < config.CHECKOUT_WORKERS:
+            worker = Thread(target=process_checkouts, daemon=True)
+            worker.start()
+            workers.append(worker)
+
+    return len(workers)
+
+
+def enqueue_checkout(uname):
+    """
+    Validate the given user's cart and queue its checkout. The cart is
+    snapshotted when it is queued, so units added to the cart afterwards are
+    not part of the order.
+
+    :param str uname: Username
+
+    :returns:
+        - A list containing *0* and the ID the order will have.
+        - A list containing *1* if the user was not found.
+        - A list containing *2* if the user's cart is empty.
+        - A list containing *5* if the queue is full.
+
+    """
+
+    user = get_user(uname)
+    if not user:
+        return [1]
+
+    if not user['cart']:
+        return [2]
+
+    start_checkout_workers()
+    order_id = str(uuid4())
+    doc_id = queued_checkouts.insert({'order_id': order_id, 'username': uname, 'cart': dict(user['cart'])})
+    checkout_statuses[order_id] = {'status': 'pending', 'username': uname}
+    try:
+        checkout_jobs.put_nowait((doc_id, order_id, uname, dict(user['cart'])))
+    except Full:
+        del checkout_statuses[order_id]
+        queued_checkouts.remove(doc_ids=[doc_id])
+        return [5]
+
+    return [0, order_id]
+
+
+def resume_checkouts():
+    """
+    Queue again the checkouts that were queued but not completed before the
+    server stopped.
+
+    :returns: Number of checkouts queued again
+    :rtype: *int*
+
+    """
+
+    resumed = 0
+    for job in queued_checkouts:
+        if not resumed:
+            start_checkout_workers()
+
+        checkout_statuses[job['order_id']] = {'status': 'pending', 'username': job['username']}
+        checkout_jobs.put((job.doc_id, job['order_id'], job['username'], job['cart']))
+        resumed += 1
+
+    return resumed
+
+
+def get_checkout_status(order_id):
+    """
+    Get the status of a queued checkout.
+
+    :param str order_id: ID of the order returned when the checkout was queued
+
+    :returns: The status of the checkout along with the username of the user who queued it,
+        *None* if no checkout with this order ID is known to the queue, in which case it
+        either completed, failed before the server restarted or never existed
+    :rtype: *dict*
+
+    - Example
+
+    .. code-block:: JSON
+
+        {
+            "status": "failed",
+            "message": "Not enough inventory for product(s): f4ad5da8-2cc5-4ec0-86f3-4c02367c082f",
+            "username": "Uraraka"
+        }
+
+    """
+
+    with failed_checkouts_lock:
+        status = failed_checkouts.get(order_id) or checkout_statuses.get(order_id)
+
+    return dict(status) if status else None
+
+
+def record_failed_checkout(order_id, uname, message):
+    """
+    Record why a checkout failed, forgetting the oldest failed checkouts if
+    too many are recorded.
+
+    :param str order_id: ID of the order of the checkout
+    :param str uname: Username of the user who queued the checkout
+    :param str message: Message explaining the failure
+
+    """
+
+    with failed_checkouts_lock:
+        failed_checkouts[order_id] = {'status': 'failed', 'message': message, 'username': uname}
+        while len(failed_checkouts) > config.FAILED_CHECKOUTS_KEPT:
+            failed_checkouts.popitem(last=False)
+
+    checkout_statuses.pop(order_id, None)
+
+
+def process_checkouts():
+    """
+    Complete the queued checkouts one after the other, and forget them once
+    completed or failed. A checkout whose order already exists, because it
+    was completed just before the server stopped, is not completed again.
+    Run by each worker thread.
+    """
+
+    while True:
+        doc_id, order_id, uname, quantities = checkout_jobs.get()
+        checkout_statuses[order_id] = {'status': 'processing', 'username': uname}
+        try:
+            outcome = checkout(uname, order_id, quantities) if order_id not in order_index else [0]
+            if outcome[0] == 0:
+                del checkout_statuses[order_id]
+            else:
+                record_failed_checkout(order_id, uname, describe_checkout_failure(outcome))
+
+            if queued_checkouts.contains(doc_id=doc_id):
+                queued_checkouts.remove(doc_ids=[doc_id])
+
+            flush()
+        except Exception as error:
+            record_failed_checkout(order_id, uname, str(error))
+        finally:
+            checkout_jobs.task_done()
+
+
+resume_checkouts()
@@ -0,0 +1,80 @@
+"""
+Configuration of the marketplace. Every setting can be overridden through
+the environment variable named in its comment.
+"""
+
+import os
+
+# MARKETPLACE_DB_ENGINE - storage engine of the database file, one of:
+#   json   - TinyDB's JSON storage, rewriting the whole file on every flush
+#   log    - append-only log of the modified documents, see log_storage
+#   sqlite - SQLite database with one row per document, see sqlite_storage
+DB_ENGINE = os.environ.get('MARKETPLACE_DB_ENGINE', 'json')
+
+# MARKETPLACE_DB_PATH - path of the database file
+DB_PATH = os.environ.get('MARKETPLACE_DB_PATH', 'db.sqlite3' if DB_ENGINE == 'sqlite' else 'db.json')
+
+# MARKETPLACE_LOG_COMPACT_AFTER - number of log records after which the log
+# storage writes a new snapshot and empties its log
+LOG_COMPACT_AFTER = int(os.environ.get('MARKETPLACE_LOG_COMPACT_AFTER', 10000))
+
+# MARKETPLACE_HASH_WORKERS - number of processes hashing passwords, 0 hashes them
+# on the request threads
+HASH_WORKERS = int(os.environ.get('MARKETPLACE_HASH_WORKERS', 2))
+
+# MARKETPLACE_HASH_QUEUE_SIZE - maximum number of passwords being hashed or waiting
+# to be hashed, further sign ups and sign ins are rejected
+HASH_QUEUE_SIZE = int(os.environ.get('MARKETPLACE_HASH_QUEUE_SIZE', 32))
+
+# MARKETPLACE_HASH_ROUNDS - number of rounds of the password hashes, 0 uses
+# passlib's default. Passwords hashed with other rounds are rehashed on sign in.
+HASH_ROUNDS = int(os.environ.get('MARKETPLACE_HASH_ROUNDS', 0))
+
+# MARKETPLACE_SECRET_KEY - key signing the session tokens. A random key is generated
+# on startup if it is not set, in which case tokens do not survive a restart.
+SECRET_KEY = os.environ.get('MARKETPLACE_SECRET_KEY') or os.urandom(32).hex()
+
+# MARKETPLACE_SESSION_TTL - number of seconds a session token stays valid
+SESSION_TTL = int(os.environ.get('MARKETPLACE_SESSION_TTL', 86400))
+
+# MARKETPLACE_SESSION_CACHE_SIZE - maximum number of sessions kept in the cache of
+# active sessions
+SESSION_CACHE_SIZE = int(os.environ.get('MARKETPLACE_SESSION_CACHE_SIZE', 10000))
+
+# MARKETPLACE_REQUIRE_AUTH - "true" to reject cart and order requests without a
+# session token. Requests with a token are always checked.
+REQUIRE_AUTH = os.environ.get('MARKETPLACE_REQUIRE_AUTH', 'false').lower() == 'true'
+
+# MARKETPLACE_ORDER_SEGMENT_SIZE - number of orders per segment file when the orders
+# are stored in segments instead of the database file, see order_segments.
+# 0 keeps the orders in the database file.
+ORDER_SEGMENT_SIZE = int(os.environ.get('MARKETPLACE_ORDER_SEGMENT_SIZE', 0))
+
+# MARKETPLACE_ORDER_SEGMENTS_PATH - directory holding the order segments
+ORDER_SEGMENTS_PATH = os.environ.get('MARKETPLACE_ORDER_SEGMENTS_PATH', DB_PATH + '.orders')
+
+# MARKETPLACE_IMPORT_BATCH_SIZE - number of products written to the database at
+# once when importing a product feed
+IMPORT_BATCH_SIZE = int(os.environ.get('MARKETPLACE_IMPORT_BATCH_SIZE', 1000))
+
+# MARKETPLACE_MAX_PAGE_SIZE - maximum number of products or orders in a page, and of
+# products looked up at once by ID
+MAX_PAGE_SIZE = int(os.environ.get('MARKETPLACE_MAX_PAGE_SIZE', 1000))
+
+# MARKETPLACE_RESPONSE_CACHE_SIZE - maximum number of catalog responses cached
+RESPONSE_CACHE_SIZE = int(os.environ.get('MARKETPLACE_RESPONSE_CACHE_SIZE', 1000))
+
+# MARKETPLACE_URI_PREFIX_CACHE_SIZE - maximum number of hosts whose product URI
+# prefix is cached
+URI_PREFIX_CACHE_SIZE = int(os.environ.get('MARKETPLACE_URI_PREFIX_CACHE_SIZE', 64))
+
+# MARKETPLACE_CHECKOUT_WORKERS - number of threads completing asynchronous checkouts
+CHECKOUT_WORKERS = int(os.environ.get('MARKETPLACE_CHECKOUT_WORKERS', 2))
+
+# MARKETPLACE_CHECKOUT_QUEUE_SIZE - maximum number of asynchronous checkouts waiting
+# to be completed, further checkouts are rejected
+CHECKOUT_QUEUE_SIZE = int(os.environ.get('MARKETPLACE_CHECKOUT_QUEUE_SIZE', 1000))
+
+# MARKETPLACE_FAILED_CHECKOUTS_KEPT - number of failed asynchronous checkouts whose
+# status is kept, the oldest ones are forgotten
+FAILED_CHECKOUTS_KEPT = int(os.environ.get('MARKETPLACE_FAILED_CHECKOUTS_KEPT', 10000))
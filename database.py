@@ -0,0 +1,220 @@
+"""
+Shared storage of the marketplace. All the function modules read and write
+the same in-memory copy of the database, and the changes made while handling
+a request are written to disk in one go when :func:`flush` is called at the
+end of the request. If the storage rejects a write, or a transaction fails,
+the pending changes are discarded and the database is read again from disk.
+
+Only one process can use the database at a time, since each process keeps
+its own copy in memory and would overwrite the changes of the others. The
+database is locked through a lock file next to it, from the moment this
+module is imported until the process exits.
+"""
+
+import atexit
+import fcntl
+from contextlib import contextmanager
+from threading import RLock
+from tinydb import TinyDB
+from tinydb.middlewares import CachingMiddleware
+from tinydb.storages import JSONStorage
+from tinydb.table import Table
+from incremental_storage import ConflictError
+from log_storage import LogStorage
+from order_segments import SegmentedOrders
+from sqlite_storage import SQLiteStorage
+import config
+
+lock = RLock()
+# Functions rebuilding the in-memory indexes after the database is read again, see on_reload
+reload_hooks = []
+
+
+class MarketplaceTable(Table):
+    """
+    Table whose modifications are serialised by :data:`lock`, so that
+    concurrent requests never interleave their read-modify-write cycles
+    on the shared in-memory copy of the database.
+
+    The IDs of the modified documents are reported to storages that can
+    write them incrementally, see :class:`incremental_storage.IncrementalStorage`.
+    """
+
+    def insert(self, document):
+        with lock:
+            doc_id = super().insert(document)
+            self._mark_dirty([doc_id])
+
+        return doc_id
+
+    def insert_multiple(self, documents):
+        with lock:
+            doc_ids = super().insert_multiple(documents)
+            self._mark_dirty(doc_ids)
+
+        return doc_ids
+
+    def update(self, fields, cond=None, doc_ids=None):
+        with lock:
+            updated_ids = super().update(fields, cond, doc_ids)
+            self._mark_dirty(updated_ids)
+
+        return updated_ids
+
+    def update_multiple(self, updates):
+        with lock:
+            updated_ids = super().update_multiple(updates)
+            self._mark_dirty(updated_ids)
+
+        return updated_ids
+
+    def remove(self, cond=None, doc_ids=None):
+        with lock:
+            removed_ids = super().remove(cond, doc_ids)
+            self._mark_dirty(removed_ids)
+
+        return removed_ids
+
+    def truncate(self):
+        with lock:
+            super().truncate()
+            self._mark_dirty(None)
+
+    def _update_table(self, updater):
+        with lock:
+            super()._update_table(updater)
+
+    def _mark_dirty(self, doc_ids):
+        mark_dirty = getattr(self._storage, 'mark_dirty', None)
+        if mark_dirty:
+            mark_dirty(self.name, doc_ids)
+
+
+class MarketplaceDB(TinyDB):
+    """
+    Database creating :class:`MarketplaceTable` tables.
+    """
+
+    table_class = MarketplaceTable
+
+    def reload(self):
+        """
+        Discard the changes not written to disk yet and read the database
+        again from the storage on the next access.
+        """
+
+        with lock:
+            self.storage.cache = None
+            self.storage._cache_modified_count = 0
+            pop_dirty = getattr(self.storage.storage, 'pop_dirty', None)
+            if pop_dirty:
+                pop_dirty()
+
+            for table in self._tables.values():
+                table._next_id = None
+                table.clear_cache()
+
+
+storages = {
+    'json': (JSONStorage, {}),
+    'log': (LogStorage, {'compact_after': config.LOG_COMPACT_AFTER}),
+    'sqlite': (SQLiteStorage, {'unique_fields': {'users': ['username', 'email'], 'products': ['product_id'],
+                                                 'orders': ['order_id']}}),
+}
+if config.DB_ENGINE not in storages:
+    raise ValueError('Unknown database engine: ' + config.DB_ENGINE)
+
+# Kept open, and so locked, until the process exits
+lock_file = open(config.DB_PATH + '.lock', 'w')
+try:
+    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+except BlockingIOError:
+    raise RuntimeError('The database {} is in use by another process, stop the server first'.format(config.DB_PATH))
+
+storage_class, storage_options = storages[config.DB_ENGINE]
+storage = CachingMiddleware(storage_class)
+
+# Only flush at the end of a request, so that storages writing incrementally
+# have been told about every modified document by the time they write
+storage.WRITE_CACHE_SIZE = float('inf')
+
+db = MarketplaceDB(config.DB_PATH, storage=storage, **storage_options)
+users = db.table('users')
+products = db.table('products')
+
+# Orders are either kept in the database file or appended to segment files
+if config.ORDER_SEGMENT_SIZE:
+    orders = SegmentedOrders(config.ORDER_SEGMENTS_PATH, config.ORDER_SEGMENT_SIZE)
+    atexit.register(orders.close)
+else:
+    orders = db.table('orders')
+
+
+def on_reload(function):
+    """
+    Register a function to call once the database was read again after its
+    pending changes were discarded, to rebuild what was computed from them.
+
+    :param function: Function taking no arguments
+
+    :returns: The function
+
+    """
+
+    reload_hooks.append(function)
+    return function
+
+
+def flush():
+    """
+    Write the changes made to the in-memory copy of the database since
+    the last flush to disk. Does nothing if there are no pending changes.
+    If the storage rejects the changes, they are discarded, so that the
+    in-memory copy matches the disk again.
+
+    :raises ConflictError: If the changes conflict with the data already stored
+
+    """
+
+    with lock:
+        try:
+            db.storage.flush()
+        except ConflictError:
+            discard_changes()
+            raise
+
+
+def discard_changes():
+    """
+    Discard the changes made to the in-memory copy of the database since
+    the last flush, read it again from disk and call the functions
+    registered with :func:`on_reload`.
+    """
+
+    with lock:
+        db.reload()
+        for rebuild in reload_hooks:
+            rebuild()
+
+
+@contextmanager
+def transaction():
+    """
+    Group changes to the database into one atomic unit. No other thread can
+    modify or flush the database while the transaction is open, and the
+    changes made inside it are flushed together when it ends, in a single
+    write of the storage. If the body of the transaction raises, every
+    change not flushed yet is discarded instead.
+    """
+
+    with lock:
+        try:
+            yield
+        except BaseException:
+            discard_changes()
+            raise
+
+        flush()
+
+
+atexit.register(db.close)
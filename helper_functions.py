@@ -1,8 +1,20 @@
-from flask import url_for
+import json
+from collections import OrderedDict
+from threading import Lock
+from flask import request, url_for
+import config
+
+# Host URLs mapped to the prefix of the product URIs on that host, least recently used first
+product_uri_prefixes = OrderedDict()
+product_uri_prefixes_lock = Lock()
+
 
 def generate_product_uri(product_id):
     """
-    Generate a product URI based on its ID.
+    Generate a product URI based on its ID. The URI is only built with
+    *url_for* once per host, and reused as a template for every product.
+    The host comes from the request, so only the prefixes of the most
+    recently used hosts are kept. Has to be called while handling a request.
 
     :param str product_id: ID of the product
 
@@ -11,7 +23,86 @@ def generate_product_uri(product_id):
 
     """
 
-    return url_for('route_get_product', pid=product_id, _external=True)
+    host_url = request.host_url
+    with product_uri_prefixes_lock:
+        prefix = product_uri_prefixes.get(host_url)
+        if prefix is not None:
+            product_uri_prefixes.move_to_end(host_url)
+
+    if prefix is None:
+        placeholder = 'PRODUCT_ID'
+        prefix = url_for('route_get_product', pid=placeholder, _external=True)[:-len(placeholder)]
+        with product_uri_prefixes_lock:
+            product_uri_prefixes[host_url] = prefix
+            while len(product_uri_prefixes) > config.URI_PREFIX_CACHE_SIZE:
+                product_uri_prefixes.popitem(last=False)
+
+    return prefix + product_id
+
+
+def serialize_product(product):
+    """
+    Prepare a product to be sent to a client, adding its URI. Products are
+    stored without their URI, which depends on the host the service is
+    reached through.
+
+    :param dict product: Product as stored in the database, or *None*
+
+    :returns: A copy of the product with its URI, *None* if *product* is *None*
+    :rtype: *dict*
+
+    """
+
+    if product is None:
+        return None
+
+    return dict(product, uri=generate_product_uri(product['product_id']))
+
+
+def serialize_products(products):
+    """
+    Prepare several products to be sent to a client, see :func:`serialize_product`.
+
+    :param products: Iterable of products
+
+    :returns: The products with their URIs
+    :rtype: *list*
+
+    """
+
+    return [serialize_product(product) for product in products]
+
+
+def serialize_cart(cart):
+    """
+    Prepare a cart to be sent to a client, see :func:`serialize_product`.
+
+    :param dict cart: Cart as returned by :func:`cart_functions.get_user_cart`
+
+    :returns: A copy of the cart whose products have their URIs
+    :rtype: *dict*
+
+    """
+
+    return dict(cart, products=serialize_products(cart['products']))
+
+
+def serialize_order(order):
+    """
+    Prepare an order to be sent to a client, see :func:`serialize_product`.
+    Orders holding line items instead of products are returned as they are.
+
+    :param dict order: Order
+
+    :returns: A copy of the order whose products have their URIs
+    :rtype: *dict*
+
+    """
+
+    if 'products' not in order:
+        return order
+
+    return dict(order, products=serialize_products(order['products']))
 
 
 def find_func(string, substring):
@@ -31,3 +122,49 @@ def find_func(string, substring):
         return True
 
     return False
+
+
+def title_ngrams(title, n=3):
+    """
+    Get the n-grams of a title, ignoring case.
+
+    :param str title: Title to split into n-grams
+    :param int n: Length of the n-grams
+
+    :returns: The set of the n-grams of the lowercased title, empty if the title is shorter than *n*
+    :rtype: *set*
+
+    """
+
+    title = title.lower()
+    return {title[i:i + n] for i in range(len(title) - n + 1)}
+
+
+def stream_json_list(key, items, chunk_size=65536):
+    """
+    Serialise a JSON object holding a single list piece by piece, so that the
+    list never has to be built or serialised as a whole.
+
+    :param str key: Key of the list in the JSON object
+    :param items: Iterable of the JSON serialisable items of the list
+    :param int chunk_size: Approximate size in characters of the chunks generated
+
+    :returns: A generator of the chunks of the JSON document
+
+    """
+
+    chunk = ['{' + json.dumps(key) + ': [']
+    chunk_length = 0
+    separator = ''
+    for item in items:
+        serialised_item = separator + json.dumps(item, sort_keys=True)
+        separator = ', '
+        chunk.append(serialised_item)
+        chunk_length += len(serialised_item)
+        if chunk_length >= chunk_size:
+            yield ''.join(chunk)
+            chunk = []
+            chunk_length = 0
+
+    chunk.append(']}')
+    yield ''.join(chunk)
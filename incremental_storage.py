@@ -0,0 +1,53 @@
+"""
+Base class for TinyDB storages that write only the documents modified since
+their last write instead of the whole database.
+"""
+
+from tinydb.storages import Storage
+
+
+class ConflictError(Exception):
+    """
+    Raised by a storage when a write conflicts with the data already stored,
+    for instance because it breaks a uniqueness constraint. Nothing of the
+    write is stored.
+    """
+
+
+class IncrementalStorage(Storage):
+    """
+    Storage that is told which documents were modified before each write
+    through :meth:`mark_dirty`. :class:`database.MarketplaceTable` reports
+    every document it inserts, updates or removes.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._dirty = {}
+
+    def mark_dirty(self, table_name, doc_ids):
+        """
+        Record that documents of a table were modified, so that the next
+        write stores them.
+
+        :param str table_name: Name of the table
+        :param list doc_ids: IDs of the modified documents, *None* if the whole table was replaced
+
+        """
+
+        if doc_ids is None or self._dirty.get(table_name, set()) is None:
+            self._dirty[table_name] = None
+        else:
+            self._dirty.setdefault(table_name, set()).update(str(doc_id) for doc_id in doc_ids)
+
+    def pop_dirty(self):
+        """
+        Return the documents marked as modified and forget about them.
+
+        :returns: Table names mapped to the set of IDs of their modified documents, or to *None* if the whole table was replaced
+        :rtype: *dict*
+
+        """
+
+        dirty, self._dirty = self._dirty, {}
+        return dirty
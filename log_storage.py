@@ -0,0 +1,190 @@
+"""
+Append-only log storage for TinyDB.
+
+Instead of rewriting the whole database file on every write, each write
+appends one record per modified document to a log file next to the database
+file, followed by a commit record. On startup the last snapshot is loaded
+and the committed records are replayed on top of it. Once enough records have
+piled up the log is compacted: a new snapshot is written and the log is
+emptied.
+
+The snapshot uses the same format as TinyDB's *JSONStorage*, so a database
+file can be moved between the two storages as long as the log was compacted,
+which happens when the storage is closed by the process that wrote to it.
+Only one process can open the storage at a time: the log is locked for as
+long as the storage is open.
+"""
+
+import fcntl
+import json
+import os
+from incremental_storage import IncrementalStorage
+
+
+class LogStorage(IncrementalStorage):
+    """
+    Store the data as a JSON snapshot plus an append-only log of the
+    documents modified since the snapshot was taken. A write without any
+    document marked as modified falls back to writing a whole new snapshot.
+    """
+
+    def __init__(self, path, compact_after=10000):
+        """
+        Open the storage, creating the snapshot and log files if needed, and
+        lock the log.
+
+        :param str path: Path of the snapshot file. The log is stored in the same path with a *.log* suffix.
+        :param int compact_after: Number of records after which the log is compacted into a new snapshot
+
+        :raises RuntimeError: If another process has the storage open
+
+        """
+
+        super().__init__()
+        self._path = path
+        self._log_path = path + '.log'
+        self._compact_after = compact_after
+        self._data = None
+        self._records = 0
+        self._written = False
+        self._log = open(self._log_path, 'ab+')
+        try:
+            fcntl.flock(self._log, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._log.close()
+            raise RuntimeError('The database {} is open in another process'.format(path))
+
+    def read(self):
+        """
+        Read the snapshot and replay the committed records of the log on
+        top of it. An uncommitted tail left by an interrupted write is
+        discarded.
+
+        :returns: The database contents, *None* if the database is empty
+        :rtype: *dict*
+
+        """
+
+        if self._data is None:
+            self._data = self._load_snapshot()
+            self._replay_log()
+
+        return self._data or None
+
+    def write(self, data):
+        """
+        Append a record for every document marked as modified, then a
+        commit record. Compacts the log if it grew past its limit.
+
+        :param dict data: The database contents
+
+        """
+
+        self._data = data
+        self._written = True
+        dirty = self.pop_dirty()
+        if not dirty:
+            self.compact()
+            return
+
+        lines = []
+        for table_name, doc_ids in dirty.items():
+            table = data.get(table_name)
+            if doc_ids is None:
+                lines.append(json.dumps({'table': table_name, 'documents': table}))
+                continue
+
+            for doc_id in doc_ids:
+                document = table.get(doc_id) if table is not None else None
+                lines.append(json.dumps({'table': table_name, 'doc_id': doc_id, 'document': document}))
+
+        self._records += len(lines)
+        lines.append(json.dumps({'commit': self._records}))
+
+        self._log.write(('\n'.join(lines) + '\n').encode('utf-8'))
+        self._log.flush()
+        os.fsync(self._log.fileno())
+
+        if self._records >= self._compact_after:
+            self.compact()
+
+    def compact(self):
+        """
+        Write the current contents of the database as a new snapshot and
+        empty the log. The snapshot is written to a temporary file first and
+        then moved in place, so a crash never leaves a partial snapshot.
+        """
+
+        if self._data is None:
+            return
+
+        tmp_path = self._path + '.tmp'
+        with open(tmp_path, 'w') as snapshot:
+            json.dump(self._data, snapshot)
+            snapshot.flush()
+            os.fsync(snapshot.fileno())
+
+        os.replace(tmp_path, self._path)
+        self._log.truncate(0)
+        self._records = 0
+        self.pop_dirty()
+
+    def close(self):
+        """
+        Compact the log if this process wrote to it, and close the storage.
+        Records replayed but not written by this process are left in the
+        log, so that a process that only read the database never replaces
+        the snapshot with a stale copy.
+        """
+
+        if self._written and self._records:
+            self.compact()
+
+        self._log.close()
+
+    def _load_snapshot(self):
+        if not os.path.exists(self._path) or not os.path.getsize(self._path):
+            return {}
+
+        with open(self._path) as snapshot:
+            return json.load(snapshot)
+
+    def _replay_log(self):
+        self._log.seek(0)
+        offset = committed_offset = 0
+        pending = []
+        for line in self._log:
+            try:
+                record = json.loads(line.decode('utf-8'))
+            except ValueError:
+                break
+
+            offset += len(line)
+            if 'commit' not in record:
+                pending.append(record)
+                continue
+
+            for change in pending:
+                self._apply(change)
+
+            self._records += len(pending)
+            committed_offset = offset
+            pending = []
+
+        self._log.truncate(committed_offset)
+
+    def _apply(self, record):
+        table_name = record['table']
+        if 'documents' in record:
+            if record['documents'] is None:
+                self._data.pop(table_name, None)
+            else:
+                self._data[table_name] = record['documents']
+
+            return
+
+        table = self._data.setdefault(table_name, {})
+        if record['document'] is None:
+            table.pop(record['doc_id'], None)
+        else:
+            table[record['doc_id']] = record['document']
@@ -1,19 +1,132 @@
-from flask import Flask, jsonify, abort, make_response, request
-from tinydb import TinyDB
+from itertools import chain
+import click
+from flask import Flask, Response, jsonify, abort, make_response, request, stream_with_context
+import config
+from database import flush
+from incremental_storage import ConflictError
 from user_functions import sign_in, sign_up, get_user, get_user_by_email
-from product_functions import add_product, get_all_products, get_product, find_products, delete_product, decrement_inventories
-from helper_functions import generate_product_uri
-from cart_functions import add_product_to_cart, remove_product_from_cart, get_user_cart, clear_user_cart
-from order_functions import get_order, generate_order
-
-db = TinyDB('db.json')
-products = db.table('products')
-users = db.table('users')
-orders = db.table('orders')
+from product_functions import validate_product, add_product, import_products, get_all_products, iter_products, get_products_page, get_product, get_products, find_products, iter_find_products, delete_product
+from helper_functions import serialize_product, serialize_products, serialize_cart, serialize_order, stream_json_list
+from cart_functions import validate_quantity, validate_cart_operation, apply_cart_operations, add_product_to_cart, remove_product_from_cart, get_user_cart
+from order_functions import get_order, get_user_orders, checkout, describe_checkout_failure
+from checkout_queue import enqueue_checkout, get_checkout_status
+from session_functions import create_session, get_session_user
+from password_hashing import start_hashing_workers
+from response_cache import cache_response
 
 app = Flask(__name__)
 
 
+'''
+Request hooks
+'''
+
+@app.after_request
+def flush_database(response):
+    """
+    Write the changes made to the database while handling the request
+    to disk before the response is sent. If the changes conflict with the
+    data already stored, nothing is written and a 409 error is returned
+    instead of the response.
+    """
+    try:
+        flush()
+    except ConflictError as error:
+        return write_conflict(error)
+
+    return response
+
+
+'''
+Request and response helpers
+'''
+
+def page_arguments():
+    """
+    Read the *limit* and *cursor* query parameters of a paged endpoint.
+    Aborts with a 400 (Bad request) error if either of them is invalid.
+
+    :returns: A list containing the limit, which defaults to the maximum page size,
+        and the cursor, which is *None* for the first page
+
+    """
+    limit, cursor = request.args.get('limit'), request.args.get('cursor')
+    error_msg = ""
+    error_occured = True
+    if limit is not None and (not limit.isdigit() or not 0 < int(limit) <= config.MAX_PAGE_SIZE):
+        error_msg = "Limit has to be a number between 1 and {}".format(config.MAX_PAGE_SIZE)
+    elif cursor is not None and not cursor.isdigit():
+        error_msg = "Cursor is invalid"
+    else:
+        error_occured = False
+
+    if error_occured:
+        abort(400, error_msg)
+
+    return [int(limit or config.MAX_PAGE_SIZE), int(cursor) if cursor else None]
+
+
+def authorize(username):
+    """
+    Check that the request may act on behalf of the user *username*. The
+    session token returned on sign in is read from the *Authorization*
+    header, as ``Bearer <token>``. Requests without a token are let through
+    unless authentication is required by the configuration.
+    Aborts with a 401 (Unauthorized) error if the token is missing when it
+    is required, invalid or expired, and with a 403 (Forbidden) error if it
+    was issued to another user.
+
+    :param str username: Username of the user whose data the request reads or changes
+
+    """
+
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme != 'Bearer' or not token:
+        if config.REQUIRE_AUTH:
+            abort(401, "Session token not provided")
+
+        return
+
+    session_user = get_session_user(token)
+    if not session_user:
+        abort(401, "Session token is invalid or expired")
+
+    if session_user != username:
+        abort(403, "Session token belongs to another user")
+
+
+def abort_order_not_found():
+    """
+    Abort with a 404 (Not found) error for an order that does not exist.
+    Requests with a session token, and every request when authentication is
+    required, are refused as for the order of another user instead, so that
+    the response does not tell whether an order with the given ID exists.
+
+    """
+
+    authorize(None)
+    abort(404, 'Order not found')
+
+
+def stream_products(products):
+    """
+    Stream a JSON object whose *products* list is serialised while the
+    products are generated, so that the whole list is never held in memory.
+
+    :param products: Generator of products
+
+    :returns: A streamed response, or a 404 (Not found) error if there are no products
+
+    """
+    first_product = next(products, None)
+    if first_product is None:
+        abort(404, 'Product(s) not found')
+
+    serialized_products = map(serialize_product, chain([first_product], products))
+    return Response(stream_with_context(stream_json_list('products', serialized_products)),
+                    mimetype='application/json')
+
+
 '''
 Endpoints
 '''
@@ -47,16 +160,17 @@ def route_sign_up():
                 {
                     "username": "johndoe",
                     "email": "johndoe@email.com"
-                    "cart": [
-                        "63f6-bj6m-345k",
-                        "354g-3427-nb38"
-                    ]
+                    "cart": {
+                        "63f6-bj6m-345k": 1,
+                        "354g-3427-nb38": 2
+                    }
                 }
         }
 
     :Status Codes:
         - 201 Created - New user signed up
         - 400 Bad Request - Malformed request
+        - 503 Service unavailable - Too many passwords being hashed
 
     """
 
@@ -79,8 +193,17 @@ def route_sign_up():
     if error_occured:
         abort(400, error_msg)
 
-    uname = sign_up(username, password, email)
-    new_user = get_user(uname)
+    error_code = sign_up(username, password, email)
+    if error_code == 1:
+        abort(400, "Username already being used")
+
+    if error_code == 2:
+        abort(400, "Email already registered")
+
+    if error_code == 3:
+        abort(503, "Too many sign ins, please try again")
+
+    new_user = get_user(username)
 
     return jsonify({'message': 'User signed up successfully', 'new_user': new_user}), 201
 
@@ -88,7 +211,9 @@ def route_sign_up():
 @app.route('/marketplace/api/sign-in', methods=['POST'])
 def route_sign_in():
     """
-    Perform sign in of a user.
+    Perform sign in of a user. The session token returned has to be sent in
+    the *Authorization* header of the cart and order requests, as
+    ``Bearer <token>``.
 
     **Example** -
 
@@ -106,13 +231,15 @@ def route_sign_in():
     .. code-block:: JSON
 
         {
-            "message": "Login successful"
+            "message": "Login successful",
+            "token": "eyJ1c2VybmFtZSI6ImpvaG5kb2UiLCJzZXNzaW9uX2lkIjoiNjJmMi..."
         }
 
     :Status Codes:
         - 200 OK - Login successful
         - 404 Not found - Username not found
         - 400 Bad request - Incorrect password
+        - 503 Service unavailable - Too many passwords being hashed
 
     """
 
@@ -123,7 +250,10 @@ def route_sign_in():
     if error_code == 2:
         abort(400, "Incorrect password")
 
-    return jsonify({'message': 'Login successful'})
+    if error_code == 3:
+        abort(503, "Too many sign ins, please try again")
+
+    return jsonify({'message': 'Login successful', 'token': create_session(request.json['username'])})
 
 
 ### Product endpoints ###
@@ -153,6 +283,7 @@ def route_add_product():
             "added_product": {
                 "inventory_count": 27,
                 "price": 8.49,
+                "product_id": "c6e63640-a8f0-48fb-921e-a2c5467dfdda",
                 "title": "Strawberry tart",
                 "uri": "http://localhost:5000/marketplace/api/product/c6e63640-a8f0-48fb-921e-a2c5467dfdda"
             }
@@ -164,71 +295,130 @@ def route_add_product():
 
     """
 
-    title, price, inventory = request.json['title'], request.json['price'], request.json['inventory_count']
-    error_msg = ""
-    error_occured = True
-    if not title:
-        error_msg = "Title of product is missing"
-    elif not isinstance(price, (int, float)):
-        error_msg = "Price of product has to be a number"
-    elif price < 0:
-        error_msg = "Price of product has to be non-negative"
-    elif not isinstance(inventory, int):
-        error_msg = "Inventory of product has to be a number"
-    elif inventory < 0:
-        error_msg = "Inventory of product has to be non-negative"
-    else:
-        error_occured = False
-
-    if error_occured:
+    error_msg = validate_product(request.json)
+    if error_msg:
         abort(400, error_msg)
 
+    title, price, inventory = request.json['title'], request.json['price'], request.json['inventory_count']
     new_product_id = add_product(title, price, inventory)
-    return jsonify({'added_product': {'title': title, 'price': price, 'inventory_count': inventory, 'uri': generate_product_uri(new_product_id)}}), 201
+    return jsonify({'added_product': serialize_product({'product_id': new_product_id, 'title': title, 'price': price,
+                                                        'inventory_count': inventory})}), 201
+
+
+@app.route('/marketplace/api/import-products', methods=['POST'])
+def route_import_products():
+    """
+    Import products from a feed holding one JSON product per line
+    (NDJSON), validated like the products added one at a time. The feed
+    is read as it is received and the products are written to the
+    database in batches. Invalid lines are skipped and reported with
+    their line number.
+
+    **Example** -
+
+    :Request Body:
+
+    .. code-block:: JSON
+
+        {"title": "Strawberry tart", "price": 8.49, "inventory_count": 27}
+        {"title": "Lemon tart", "price": "3.25", "inventory_count": 40}
+        {"title": "Apple pie", "price": 6.99, "inventory_count": 12}
+
+    :Response JSON Object:
+
+    .. code-block:: JSON
+
+        {
+            "errors": [
+                {
+                    "line": 2,
+                    "message": "Price of product has to be a number"
+                }
+            ],
+            "imported": 2,
+            "message": "Products imported"
+        }
+
+    :Status Codes:
+        - 200 OK - Feed imported, possibly with errors
+
+    """
+
+    imported, errors = import_products(request.stream, config.IMPORT_BATCH_SIZE)
+    return jsonify({'imported': imported, 'errors': errors, 'message': "Products imported"})
 
 
 @app.route('/marketplace/api/products', methods=['GET'])
+@cache_response
 def route_get_all_products():
     """
     Get all the products in the database with inventory greater than zero.
+    If *limit* or *cursor* is given, only one page of the products is returned
+    along with the cursor of the next page, which is *null* on the last page.
+    If *stream* is *true*, all the products are streamed as they are read instead.
 
     **Example** -
 
+    .. code-block:: python
+
+        /marketplace/api/products?limit=2
+
     :Response JSON Object:
 
     .. code-block:: JSON
 
         {
+            "next_cursor": "7",
             "products": [
                 {
                     "inventory_count": 18,
                     "price": 15.65,
+                    "product_id": "84a1c5d6-d1fd-4db0-bc1e-f450a70ca7d9",
                     "title": "Mango pizza",
                     "uri": "http://localhost:5000/marketplace/api/product/84a1c5d6-d1fd-4db0-bc1e-f450a70ca7d9"
                 },
                 {
                     "inventory_count": 51,
                     "price": 4.99,
+                    "product_id": "a37b3418-cc8f-40fa-8d63-661b3912eb71",
                     "title": "Guava cupcake",
                     "uri": "http://localhost:5000/marketplace/api/product/a37b3418-cc8f-40fa-8d63-661b3912eb71"
                 },
             ]
         }
 
+    :Query Parameters:
+        - limit - Maximum number of products in the page (optional)
+        - cursor - Cursor of the page, as returned in *next_cursor* with the previous page (optional)
+        - stream - *true* to stream all the products (optional)
+
     :Status Codes:
         - 200 OK - Products found
+        - 304 Not modified - Response unchanged since the ETag sent in *If-None-Match*
+        - 400 Bad request - Invalid limit or cursor
         - 404 Not found - Product(s) not found
 
     """
 
-    all_products = get_all_products()
-    if not all_products:
+    if request.args.get('stream') == 'true':
+        return stream_products(iter_products())
+
+    if 'limit' not in request.args and 'cursor' not in request.args:
+        all_products = get_all_products()
+        if not all_products:
+            abort(404, 'Product(s) not found')
+
+        return jsonify({'products': serialize_products(all_products)})
+
+    page, next_cursor = get_products_page(*page_arguments())
+    if not page:
         abort(404, 'Product(s) not found')
 
-    return jsonify({'products': all_products})
+    return jsonify({'products': serialize_products(page), 'next_cursor': str(next_cursor) if next_cursor else None})
 
 
 @app.route('/marketplace/api/product/<pid>', methods=['GET'])
+@cache_response
 def route_get_product(pid):
     """
     Get a single product from the database by its ID. Only returns product if it has inventory greater than zero.
@@ -247,6 +437,7 @@ def route_get_product(pid):
             "product": {
                 "inventory_count": 18,
                 "price": 15.65,
+                "product_id": "84a1c5d6-d1fd-4db0-bc1e-f450a70ca7d9",
                 "title": "Mango pizza",
                 "uri": "http://localhost:5000/marketplace/api/product/84a1c5d6-d1fd-4db0-bc1e-f450a70ca7d9"
             }
@@ -254,6 +445,7 @@ def route_get_product(pid):
 
     :Status Codes:
         - 200 OK - Product found
+        - 304 Not modified - Response unchanged since the ETag sent in *If-None-Match*
         - 404 Not found - Product not found
 
     """
@@ -262,14 +454,71 @@ def route_get_product(pid):
     if not product:
         abort(404, 'Product not found')
 
-    return jsonify({'product': product})
+    return jsonify({'product': serialize_product(product)})
+
+
+@app.route('/marketplace/api/products/batch', methods=['POST'])
+def route_get_products_batch():
+    """
+    Get several products from the database by their IDs in one request.
+    Like a single product, a product is only returned if it has inventory
+    greater than zero, otherwise it is listed as missing.
+
+    **Example** -
+
+    :Request JSON Object:
+
+    .. code-block:: JSON
+
+        {
+            "product_ids": [
+                "a37b3418-cc8f-40fa-8d63-661b3912eb71",
+                "84a1c5d6-d1fd-4db0-bc1e-f450a70ca7d9"
+            ]
+        }
+
+    :Response JSON Object:
+
+    .. code-block:: JSON
+
+        {
+            "missing": [
+                "84a1c5d6-d1fd-4db0-bc1e-f450a70ca7d9"
+            ],
+            "products": {
+                "a37b3418-cc8f-40fa-8d63-661b3912eb71": {
+                    "inventory_count": 51,
+                    "price": 4.99,
+                    "product_id": "a37b3418-cc8f-40fa-8d63-661b3912eb71",
+                    "title": "Guava cupcake",
+                    "uri": "http://localhost:5000/marketplace/api/product/a37b3418-cc8f-40fa-8d63-661b3912eb71"
+                }
+            }
+        }
+
+    :Status Codes:
+        - 200 OK - Products looked up, whether or not any was found
+        - 400 Bad request - Invalid list of product IDs
+
+    """
+
+    product_ids = request.json.get('product_ids')
+    if (not isinstance(product_ids, list) or len(product_ids) > config.MAX_PAGE_SIZE
+            or not all(isinstance(product_id, str) for product_id in product_ids)):
+        abort(400, "Product IDs have to be a list of at most {} IDs".format(config.MAX_PAGE_SIZE))
+
+    found_products, missing = get_products(product_ids)
+    return jsonify({'products': {product_id: serialize_product(product) for product_id, product in found_products.items()},
+                    'missing': missing})
 
 
 @app.route('/marketplace/api/find-products/<title>', methods=['GET'])
+@cache_response
 def route_find_products(title):
     """
     Find products in the database whose title match *title* at least partially.
     Performs case-insensitive search. Only returns products with inventory greater than zero.
+    If *stream* is *true*, the products are streamed as they are found.
 
     **Example** -
 
@@ -286,29 +535,38 @@ def route_find_products(title):
                 {
                     "inventory_count": 51,
                     "price": 4.99,
+                    "product_id": "a37b3418-cc8f-40fa-8d63-661b3912eb71",
                     "title": "Guava cupcake",
                     "uri": "http://localhost:5000/marketplace/api/product/a37b3418-cc8f-40fa-8d63-661b3912eb71"
                 },
                 {
                     "inventory_count": 12,
                     "price": 7.99,
+                    "product_id": "f4ad5da8-2cc5-4ec0-86f3-4c02367c082f",
                     "title": "Orange cupcake",
                     "uri": "http://localhost:5000/marketplace/api/product/f4ad5da8-2cc5-4ec0-86f3-4c02367c082f"
                 }
             ]
         }
 
+    :Query Parameters:
+        - stream - *true* to stream the products (optional)
+
     :Status Codes:
         - 200 OK - Product(s) found
+        - 304 Not modified - Response unchanged since the ETag sent in *If-None-Match*
         - 404 Not found - Product(s) not found
 
     """
 
+    if request.args.get('stream') == 'true':
+        return stream_products(iter_find_products(title))
+
     matching_products = find_products(title)
     if not matching_products:
         abort(404, 'Product(s) not found')
 
-    return jsonify({'products': matching_products})
+    return jsonify({'products': serialize_products(matching_products)})
 
 
 @app.route('/marketplace/api/delete-product/<pid>', methods=['DELETE'])
@@ -331,6 +589,7 @@ def route_delete_product(pid):
             "removed_product": {
                 "inventory_count": 27,
                 "price": 8.49,
+                "product_id": "c6e63640-a8f0-48fb-921e-a2c5467dfdda",
                 "title": "Strawberry tart",
                 "uri": "http://localhost:5000/marketplace/api/product/c6e63640-a8f0-48fb-921e-a2c5467dfdda"
             }
@@ -346,7 +605,7 @@ def route_delete_product(pid):
     if not outcome[0]:
         abort(404, 'Product not found')
 
-    return jsonify({'removed_product': outcome[1], 'message': 'Product deleted successfully'})
+    return jsonify({'removed_product': serialize_product(outcome[1]), 'message': 'Product deleted successfully'})
 
 
 ### Cart endpoints ###
@@ -354,7 +613,8 @@ def route_delete_product(pid):
 @app.route('/marketplace/api/add-product-to-cart', methods=['POST'])
 def route_add_product_to_cart():
     """
-    Add the given product to the given user's cart.
+    Add *quantity* units of the given product to the given user's cart.
+    *quantity* is optional and defaults to 1.
 
     **Example** -
 
@@ -364,7 +624,8 @@ def route_add_product_to_cart():
 
         {
             "username": "Midoriya",
-            "product_id": "a37b3418-cc8f-40fa-8d63-661b3912eb71"
+            "product_id": "a37b3418-cc8f-40fa-8d63-661b3912eb71",
+            "quantity": 1
         }
 
     :Response JSON Object:
@@ -377,19 +638,31 @@ def route_add_product_to_cart():
                 "product": {
                     "inventory_count": 51,
                     "price": 4.99,
+                    "product_id": "a37b3418-cc8f-40fa-8d63-661b3912eb71",
                     "title": "Guava cupcake",
                     "uri": "http://localhost:5000/marketplace/api/product/a37b3418-cc8f-40fa-8d63-661b3912eb71"
                 },
+                "quantity": 1,
                 "username": "Midoriya"
             }
         }
 
     :Status Codes:
         - 200 OK - Product added to user's cart
+        - 400 Bad request - Invalid quantity
+        - 401 Unauthorized - Session token missing, invalid or expired
+        - 403 Forbidden - Session token of another user
 
     """
 
-    uname_product = add_product_to_cart(request.json['username'], request.json['product_id'])
+    authorize(request.json['username'])
+    quantity = request.json.get('quantity', 1)
+    error_msg = validate_quantity(quantity)
+    if error_msg:
+        abort(400, error_msg)
+
+    uname_product = add_product_to_cart(request.json['username'], request.json['product_id'], quantity)
+    uname_product['product'] = serialize_product(uname_product['product'])
 
     return jsonify({'added_product_to_cart': uname_product, 'message': "Product added to cart successfully"})
 
@@ -397,7 +670,9 @@ def route_add_product_to_cart():
 @app.route('/marketplace/api/remove-product-from-cart', methods=['DELETE'])
 def route_remove_product_from_cart():
     """
-    Remove the given product from the given user's cart.
+    Remove *quantity* units of the given product from the given user's cart.
+    *quantity* is optional and defaults to 1. If the cart holds fewer units,
+    all of them are removed.
 
     **Example** -
 
@@ -407,7 +682,8 @@ def route_remove_product_from_cart():
 
         {
             "username": "Midoriya",
-            "product_id": "a37b3418-cc8f-40fa-8d63-661b3912eb71"
+            "product_id": "a37b3418-cc8f-40fa-8d63-661b3912eb71",
+            "quantity": 1
         }
 
     :Response JSON Object:
@@ -420,26 +696,122 @@ def route_remove_product_from_cart():
                 "product": {
                     "inventory_count": 51,
                     "price": 4.99,
+                    "product_id": "a37b3418-cc8f-40fa-8d63-661b3912eb71",
                     "title": "Guava cupcake",
                     "uri": "http://localhost:5000/marketplace/api/product/a37b3418-cc8f-40fa-8d63-661b3912eb71"
                 },
+                "quantity": 1,
                 "username": "Midoriya"
             }
         }
 
     :Status Codes:
         - 200 OK - Product removed from user's cart
+        - 400 Bad request - Invalid quantity
+        - 401 Unauthorized - Session token missing, invalid or expired
+        - 403 Forbidden - Session token of another user
         - 404 Not found - Product not in cart anymore
 
     """
 
-    uname_product = remove_product_from_cart(request.json['username'], request.json['product_id'])
+    authorize(request.json['username'])
+    quantity = request.json.get('quantity', 1)
+    error_msg = validate_quantity(quantity)
+    if error_msg:
+        abort(400, error_msg)
+
+    uname_product = remove_product_from_cart(request.json['username'], request.json['product_id'], quantity)
     if not uname_product:
         abort(404, 'Product not in cart anymore')
 
+    uname_product['product'] = serialize_product(uname_product['product'])
+
     return jsonify({'removed_product_from_cart': uname_product, 'message': "Product removed from cart successfully"})
 
 
+@app.route('/marketplace/api/update-cart', methods=['POST'])
+def route_update_cart():
+    """
+    Add and remove units of several products to and from the given user's
+    cart in one request. The operations are applied in order and written
+    at once, and the resulting cart is returned. Nothing is changed if any
+    operation is invalid.
+
+    **Example** -
+
+    :Request JSON Object:
+
+    .. code-block:: JSON
+
+        {
+            "username": "Uraraka",
+            "operations": [
+                {"op": "add", "product_id": "f4ad5da8-2cc5-4ec0-86f3-4c02367c082f", "quantity": 3},
+                {"op": "remove", "product_id": "a37b3418-cc8f-40fa-8d63-661b3912eb71"}
+            ]
+        }
+
+    :Response JSON Object:
+
+    .. code-block:: JSON
+
+        {
+            "message": "Cart updated successfully",
+            "user_cart": {
+                "products": [
+                    {
+                        "inventory_count": 12,
+                        "price": 7.99,
+                        "product_id": "f4ad5da8-2cc5-4ec0-86f3-4c02367c082f",
+                        "title": "Orange cupcake",
+                        "uri": "http://localhost:5000/marketplace/api/product/f4ad5da8-2cc5-4ec0-86f3-4c02367c082f"
+                    },
+                    {
+                        "inventory_count": 12,
+                        "price": 7.99,
+                        "product_id": "f4ad5da8-2cc5-4ec0-86f3-4c02367c082f",
+                        "title": "Orange cupcake",
+                        "uri": "http://localhost:5000/marketplace/api/product/f4ad5da8-2cc5-4ec0-86f3-4c02367c082f"
+                    },
+                    {
+                        "inventory_count": 12,
+                        "price": 7.99,
+                        "product_id": "f4ad5da8-2cc5-4ec0-86f3-4c02367c082f",
+                        "title": "Orange cupcake",
+                        "uri": "http://localhost:5000/marketplace/api/product/f4ad5da8-2cc5-4ec0-86f3-4c02367c082f"
+                    }
+                ],
+                "total_price": 23.97
+            },
+            "username": "Uraraka"
+        }
+
+    :Status Codes:
+        - 200 OK - Cart updated
+        - 400 Bad request - Invalid operation(s)
+        - 401 Unauthorized - Session token missing, invalid or expired
+        - 403 Forbidden - Session token of another user
+        - 404 Not found - User not found
+
+    """
+
+    username, operations = request.json['username'], request.json.get('operations')
+    authorize(username)
+    if not get_user(username):
+        abort(404, "User not found")
+
+    if not isinstance(operations, list) or not operations:
+        abort(400, "Operations have to be a non-empty list")
+
+    for position, operation in enumerate(operations, 1):
+        error_msg = validate_cart_operation(operation)
+        if error_msg:
+            abort(400, "Operation {}: {}".format(position, error_msg))
+
+    cart = apply_cart_operations(username, operations)
+    return jsonify({'user_cart': serialize_cart(cart), 'username': username, 'message': "Cart updated successfully"})
+
+
 @app.route('/marketplace/api/get-user-cart', methods=['POST'])
 def route_get_user_cart():
     """
@@ -465,12 +837,14 @@ def route_get_user_cart():
                     {
                         "inventory_count": 12,
                         "price": 7.99,
+                        "product_id": "f4ad5da8-2cc5-4ec0-86f3-4c02367c082f",
                         "title": "Orange cupcake",
                         "uri": "http://localhost:5000/marketplace/api/product/f4ad5da8-2cc5-4ec0-86f3-4c02367c082f"
                     },
                     {
                         "inventory_count": 12,
                         "price": 7.99,
+                        "product_id": "f4ad5da8-2cc5-4ec0-86f3-4c02367c082f",
                         "title": "Orange cupcake",
                         "uri": "http://localhost:5000/marketplace/api/product/f4ad5da8-2cc5-4ec0-86f3-4c02367c082f"
                     }
@@ -482,13 +856,16 @@ def route_get_user_cart():
 
     :Status Codes:
         - 200 OK - Retrieved user's cart
+        - 401 Unauthorized - Session token missing, invalid or expired
+        - 403 Forbidden - Session token of another user
 
     """
 
     username = request.json['username']
+    authorize(username)
     cart = get_user_cart(username)
 
-    return jsonify({'user_cart': cart, 'username': username})
+    return jsonify({'user_cart': serialize_cart(cart), 'username': username})
 
 
 @app.route('/marketplace/api/complete-cart', methods=['POST'])
@@ -496,11 +873,17 @@ def route_complete_cart():
     """
     Complete the given user's cart. The cart is used to generate
     an order. The user's cart is cleared. The inventories of the
-    products purchased by the user are decremented.
+    products purchased by the user are decremented. Nothing is changed
+    if any product in the cart does not have enough inventory.
 
     Return the order information along with the product(s) whose
     inventories were decremented.
 
+    If *async* is *true*, the cart is only validated and queued, and the
+    ID of the order is returned right away. The cart is then completed in
+    the background, and its progress can be followed with the order status
+    endpoint.
+
     **Example** -
 
     :Request JSON Object:
@@ -520,6 +903,7 @@ def route_complete_cart():
                 {
                     "inventory_count": 7,
                     "price": 7.99,
+                    "product_id": "f4ad5da8-2cc5-4ec0-86f3-4c02367c082f",
                     "title": "Orange cupcake",
                     "uri": "http://localhost:5000/marketplace/api/product/f4ad5da8-2cc5-4ec0-86f3-4c02367c082f"
                 }
@@ -531,12 +915,14 @@ def route_complete_cart():
                     {
                         "inventory_count": 7,
                         "price": 7.99,
+                        "product_id": "f4ad5da8-2cc5-4ec0-86f3-4c02367c082f",
                         "title": "Orange cupcake",
                         "uri": "http://localhost:5000/marketplace/api/product/f4ad5da8-2cc5-4ec0-86f3-4c02367c082f"
                     },
                     {
                         "inventory_count": 7,
                         "price": 7.99,
+                        "product_id": "f4ad5da8-2cc5-4ec0-86f3-4c02367c082f",
                         "title": "Orange cupcake",
                         "uri": "http://localhost:5000/marketplace/api/product/f4ad5da8-2cc5-4ec0-86f3-4c02367c082f"
                     },
@@ -545,25 +931,48 @@ def route_complete_cart():
             }
         }
 
+    :Response JSON Object (asynchronous):
+
+    .. code-block:: JSON
+
+        {
+            "order_id": "baef750f-9c54-41f8-a7a5-647640ff62d1",
+            "status": "pending"
+        }
+
+    :Query Parameters:
+        - async - *true* to complete the cart in the background (optional)
+
     :Status Codes:
         - 200 OK - Cart completed
+        - 202 Accepted - Cart queued for completion
+        - 401 Unauthorized - Session token missing, invalid or expired
+        - 403 Forbidden - Session token of another user
         - 404 Not found - User not found or User's cart is empty
+        - 409 Conflict - Not enough inventory for the product(s) in the cart, or cart or products changed during checkout
+        - 503 Service unavailable - Too many carts queued for completion
 
     """
 
-    username = request.json['username']
-    user = get_user(username)
-    if not user:
-        abort(404, "User not found")
+    authorize(request.json['username'])
+    if request.args.get('async') == 'true':
+        outcome = enqueue_checkout(request.json['username'])
+        if outcome[0] == 5:
+            abort(503, "Checkout queue is full, please try again")
 
-    if not user['cart']:
-        abort(404, "User's cart is empty")
+        if outcome[0] != 0:
+            abort(404, describe_checkout_failure(outcome))
 
-    affected_products = decrement_inventories(username)
-    order = get_order(generate_order(username))
-    clear_user_cart(username)
+        return jsonify({'order_id': outcome[1], 'status': 'pending'}), 202
 
-    return jsonify({'order': order, 'affected_products': affected_products})
+    outcome = checkout(request.json['username'])
+    if outcome[0] in (1, 2):
+        abort(404, describe_checkout_failure(outcome))
+
+    if outcome[0] in (3, 4):
+        abort(409, describe_checkout_failure(outcome))
+
+    return jsonify({'order': serialize_order(outcome[1]), 'affected_products': serialize_products(outcome[2])})
 
 
 ### Order endpoints ###
@@ -591,18 +1000,21 @@ def route_get_order(order_id):
                     {
                         "inventory_count": 12,
                         "price": 7.99,
+                        "product_id": "f4ad5da8-2cc5-4ec0-86f3-4c02367c082f",
                         "title": "Orange cupcake",
                         "uri": "http://localhost:5000/marketplace/api/product/f4ad5da8-2cc5-4ec0-86f3-4c02367c082f"
                     },
                     {
                         "inventory_count": 12,
                         "price": 7.99,
+                        "product_id": "f4ad5da8-2cc5-4ec0-86f3-4c02367c082f",
                         "title": "Orange cupcake",
                         "uri": "http://localhost:5000/marketplace/api/product/f4ad5da8-2cc5-4ec0-86f3-4c02367c082f"
                     },
                     {
                         "inventory_count": 12,
                         "price": 7.99,
+                        "product_id": "f4ad5da8-2cc5-4ec0-86f3-4c02367c082f",
                         "title": "Orange cupcake",
                         "uri": "http://localhost:5000/marketplace/api/product/f4ad5da8-2cc5-4ec0-86f3-4c02367c082f"
                     }
@@ -611,23 +1023,152 @@ def route_get_order(order_id):
             }
         }
 
+    :Query Parameters:
+        - hydrate - *false* to get the line items of the order as stored, with the price and quantity of each product purchased, instead of the products (optional)
+
+    :Status Codes:
+        - 200 OK - Order found
+        - 401 Unauthorized - Session token missing, invalid or expired
+        - 403 Forbidden - Session token of another user, or order *not* found
+        - 404 Not found - Order *not* found, without a session token when authentication is not required
+
+    """
+
+    order = get_order(order_id, request.args.get('hydrate') != 'false')
+    if not order:
+        abort_order_not_found()
+
+    authorize(order['username'])
+
+    return jsonify({'order': serialize_order(order)})
+
+
+@app.route('/marketplace/api/orders', methods=['GET'])
+def route_get_user_orders():
+    """
+    Get the orders of the user *username*, most recent first, one page at a time.
+    The cursor of the next page is returned along with each page, and is *null*
+    on the last page.
+
+    **Example** -
+
+    .. code-block:: python
+
+        /marketplace/api/orders?username=Uraraka&limit=1
+
+    :Response JSON Object:
+
+    .. code-block:: JSON
+
+        {
+            "next_cursor": "3",
+            "orders": [
+                {
+                    "amount": 7.99,
+                    "order_id": "274a5c89-f9ad-4043-a07c-0d545512291b",
+                    "products": [
+                        {
+                            "inventory_count": 12,
+                            "price": 7.99,
+                            "product_id": "f4ad5da8-2cc5-4ec0-86f3-4c02367c082f",
+                            "title": "Orange cupcake",
+                            "uri": "http://localhost:5000/marketplace/api/product/f4ad5da8-2cc5-4ec0-86f3-4c02367c082f"
+                        }
+                    ],
+                    "username": "Uraraka"
+                }
+            ]
+        }
+
+    :Query Parameters:
+        - username - Username of the user whose orders to get
+        - limit - Maximum number of orders in the page (optional)
+        - cursor - Cursor of the page, as returned in *next_cursor* with the previous page (optional)
+        - hydrate - *false* to get the line items of the orders as stored instead of the products (optional)
+
+    :Status Codes:
+        - 200 OK - Orders found
+        - 400 Bad request - Invalid limit or cursor
+        - 401 Unauthorized - Session token missing, invalid or expired
+        - 403 Forbidden - Session token of another user
+        - 404 Not found - User not found
+
+    """
+
+    username = request.args.get('username')
+    authorize(username)
+    if not username or not get_user(username):
+        abort(404, "User not found")
+
+    page, next_cursor = get_user_orders(username, *page_arguments(), hydrate=request.args.get('hydrate') != 'false')
+    return jsonify({'orders': [serialize_order(order) for order in page],
+                    'next_cursor': str(next_cursor) if next_cursor else None})
+
+
+@app.route('/marketplace/api/order/<order_id>/status', methods=['GET'])
+def route_get_order_status(order_id):
+    """
+    Get the status of the order with the given ID. Orders of carts completed
+    in the background are *pending* while queued, *processing* while being
+    completed, then *completed* or *failed*.
+
+    **Example** -
+
+    .. code-block:: python
+
+        /marketplace/api/order/274a5c89-f9ad-4043-a07c-0d545512291b/status
+
+    :Response JSON Object:
+
+    .. code-block:: JSON
+
+        {
+            "order_id": "274a5c89-f9ad-4043-a07c-0d545512291b",
+            "status": "failed",
+            "message": "Not enough inventory for product(s): f4ad5da8-2cc5-4ec0-86f3-4c02367c082f"
+        }
+
     :Status Codes:
         - 200 OK - Order found
-        - 404 Not found - Order *not* found
+        - 401 Unauthorized - Session token missing, invalid or expired
+        - 403 Forbidden - Session token of another user, or order *not* found
+        - 404 Not found - Order *not* found, without a session token when authentication is not required
 
     """
 
-    order = get_order(order_id)
+    status = get_checkout_status(order_id)
+    if status:
+        authorize(status.pop('username'))
+        return jsonify(dict(status, order_id=order_id))
+
+    order = get_order(order_id, hydrate=False)
     if not order:
-        abort(404, 'Order not found')
+        abort_order_not_found()
 
-    return jsonify({'order': order})
+    authorize(order['username'])
+    return jsonify({'order_id': order_id, 'status': 'completed'})
 
 
 '''
 Error handling
 '''
 
+@app.errorhandler(401)
+def unauthorized(error):
+    """
+    Return a 401 (Unauthorized) error with a custom message.
+    """
+    return make_response(jsonify({'message': error.description}), 401)
+
+
+@app.errorhandler(403)
+def forbidden(error):
+    """
+    Return a 403 (Forbidden) error with a custom message.
+    """
+    return make_response(jsonify({'message': error.description}), 403)
+
+
 @app.errorhandler(404)
 def not_found(error):
     """
@@ -644,5 +1185,61 @@ def bad_request(error):
     return make_response(jsonify({'message': error.description}), 400)
 
 
+@app.errorhandler(409)
+def conflict(error):
+    """
+    Return a 409 (Conflict) error with a custom message.
+    """
+    return make_response(jsonify({'message': error.description}), 409)
+
+
+@app.errorhandler(ConflictError)
+def write_conflict(error):
+    """
+    Return a 409 (Conflict) error when changes could not be stored because
+    they conflict with the data already stored.
+    """
+    return make_response(jsonify({'message': "Conflicting changes, nothing was saved"}), 409)
+
+
+@app.errorhandler(503)
+def service_unavailable(error):
+    """
+    Return a 503 (Service unavailable) error with a custom message.
+    """
+    return make_response(jsonify({'message': error.description}), 503)
+
+
+'''
+Command line
+'''
+
+@app.cli.command('import-products')
+@click.argument('feed', type=click.File('rb'))
+def import_products_command(feed):
+    """
+    Import products from a feed file holding one JSON product per line.
+    The command works on the database directly, so it refuses to run while
+    the server is running; post the feed to the import endpoint instead.
+
+    **Example** -
+
+    .. code-block:: python
+
+        flask --app marketplace import-products products.ndjson
+
+    """
+
+    imported, errors = import_products(feed, config.IMPORT_BATCH_SIZE)
+
+    for error in errors:
+        click.echo("Line {line}: {message}".format(**error), err=True)
+
+    click.echo("Imported {} product(s), {} line(s) skipped".format(imported, len(errors)))
+
+
 if __name__ == '__main__':
-    app.run(debug=True)
+    start_hashing_workers()
+    # The reloader's parent process imports the app too, and would keep the
+    # database open for as long as the server runs
+    app.run(debug=True, use_reloader=False)
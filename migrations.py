@@ -0,0 +1,385 @@
+"""
+Offline migrations of the database file. Changes to the shape of the
+documents are made by migration steps, applied in order. The version of
+the last step applied is stamped in the *_meta* table, which is kept as
+the first table of the file, so a later migration only applies the newer
+steps. Every step leaves the documents already in the new shape untouched,
+so a database without a stamp can safely go through all of them.
+
+The file is parsed and rewritten one document at a time, so migrating a
+database never requires holding it in memory. The migrated database is
+written next to the original one and moved in place once complete, so an
+interrupted migration leaves the original file untouched.
+
+The database file has the format of TinyDB's *JSONStorage*, also used by
+the snapshots of the log storage, whose log has to be compacted first,
+which happens when the server that wrote it stops. A database whose log
+still holds records, unless asked to compact it, or that is in use by the
+server, is not migrated.
+Orders stored in segments, see :mod:`order_segments`, are not migrated.
+Run with the server stopped:
+
+.. code-block:: python
+
+    python migrations.py db.json --dry-run
+    python migrations.py db.json
+
+The log of a database stored with the log engine is compacted into the
+database file first, loading the database in memory, with:
+
+.. code-block:: python
+
+    python migrations.py db.json --compact-log
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import sys
+import time
+from collections import Counter
+from itertools import chain
+from log_storage import LogStorage
+
+DECODER = json.JSONDecoder()
+WHITESPACE = ' \t\n\r'
+
+
+class DatabaseReader:
+    """
+    Parse a database file piece by piece, holding at most one document and
+    one chunk of the file in memory.
+    """
+
+    def __init__(self, stream, chunk_size=1 << 20):
+        """
+        :param stream: Text stream of the database file
+        :param int chunk_size: Number of characters read from the stream at once
+
+        """
+
+        self._stream = stream
+        self._chunk_size = chunk_size
+        self._buffer = ''
+        self._position = 0
+
+    def iter_tables(self):
+        """
+        Parse the tables of the database in the order they are stored.
+        Each table has to be read completely before the next one is parsed.
+
+        :returns: A generator of tuples holding the name of a table and a generator of
+            the document IDs and documents of the table
+
+        """
+
+        if self._next_char() is None:
+            return
+
+        self._expect('{')
+        if self._next_char() == '}':
+            return
+
+        while True:
+            table_name = self._decode()
+            self._expect(':')
+            self._expect('{')
+            documents = self._iter_documents()
+            yield table_name, documents
+            for _ in documents:
+                pass
+
+            if self._expect(',}') == '}':
+                return
+
+    def _iter_documents(self):
+        if self._next_char() == '}':
+            self._position += 1
+            return
+
+        while True:
+            doc_id = self._decode()
+            self._expect(':')
+            yield doc_id, self._decode()
+            if self._expect(',}') == '}':
+                return
+
+    def _next_char(self):
+        while True:
+            while self._position < len(self._buffer) and self._buffer[self._position] in WHITESPACE:
+                self._position += 1
+
+            if self._position < len(self._buffer):
+                return self._buffer[self._position]
+
+            if not self._fill():
+                return None
+
+    def _expect(self, chars):
+        char = self._next_char()
+        if char is None or char not in chars:
+            raise ValueError('Expected one of {!r} at offset {} of the chunk, found {!r}'
+                             .format(chars, self._position, char))
+
+        self._position += 1
+        return char
+
+    def _decode(self):
+        self._next_char()
+        while True:
+            try:
+                value, end = DECODER.raw_decode(self._buffer, self._position)
+            except ValueError:
+                # The value may be cut off at the end of the buffer
+                if not self._fill():
+                    raise
+                continue
+
+            # A number at the end of the buffer may go on in the next chunk, and
+            # one whose fraction or exponent was cut off stops before its '.' or 'e'
+            if (end == len(self._buffer) or self._buffer[end] in '.eE') and self._fill():
+                continue
+
+            self._position = end
+            return value
+
+    def _fill(self):
+        chunk = self._stream.read(self._chunk_size)
+        if not chunk:
+            return False
+
+        self._buffer = self._buffer[self._position:] + chunk
+        self._position = 0
+        return True
+
+
+def carts_to_quantities(table_name, document):
+    """
+    Convert a cart stored as a list holding one product ID per unit to a
+    *dict* mapping each product ID to its quantity.
+
+    :param str table_name: Name of the table of the document
+    :param dict document: Document, modified in place
+
+    :returns: Whether the document was changed
+    :rtype: *bool*
+
+    """
+
+    if table_name != 'users' or not isinstance(document.get('cart'), list):
+        return False
+
+    document['cart'] = dict(Counter(document['cart']))
+    return True
+
+
+def drop_product_uri(table_name, document):
+    """
+    Drop the URI stored in a product's document, which is only generated in
+    the responses, and recover the product's ID from it if it was not stored.
+
+    :param str table_name: Name of the table of the document
+    :param dict document: Document, modified in place
+
+    :returns: Whether the document was changed
+    :rtype: *bool*
+
+    """
+
+    if table_name != 'products' or 'uri' not in document:
+        return False
+
+    uri = document.pop('uri')
+    document.setdefault('product_id', uri.rsplit('/', 1)[-1])
+    return True
+
+
+def orders_to_line_items(table_name, document):
+    """
+    Convert an order stored with a copy of each unit of the products
+    purchased to an order holding one line item per product, with its ID,
+    the price it was purchased at and the quantity purchased.
+
+    :param str table_name: Name of the table of the document
+    :param dict document: Document, modified in place
+
+    :returns: Whether the document was changed
+    :rtype: *bool*
+
+    """
+
+    if table_name != 'orders' or 'products' not in document:
+        return False
+
+    quantities = Counter()
+    for product in document.pop('products'):
+        product_id = product.get('product_id') or product['uri'].rsplit('/', 1)[-1]
+        quantities[product_id, product['price']] += 1
+
+    document['line_items'] = [{'product_id': product_id, 'price': price, 'quantity': quantity}
+                              for (product_id, price), quantity in quantities.items()]
+    return True
+
+
+# Migration steps in the order they are applied, with the schema version they bring the database to
+MIGRATIONS = [
+    (1, "Store carts as the quantity of each product", carts_to_quantities),
+    (2, "Drop the URIs stored in the products", drop_product_uri),
+    (3, "Store orders as line items", orders_to_line_items),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def migrate_file(path, dry_run=False, report_every=100000, compact_log=False):
+    """
+    Apply the migration steps newer than the schema version of a database
+    file, and stamp the file with the latest schema version. Progress is
+    reported on the standard error.
+
+    :param str path: Path of the database file
+    :param bool dry_run: Whether to only count the documents the migration would change, without writing anything
+    :param int report_every: Number of documents between two progress reports
+    :param bool compact_log: Whether to compact the log of the log storage into the database file first
+
+    :returns: Statistics of the migration
+    :rtype: *dict*
+
+    :raises RuntimeError: If the database is in use or its log holds records that were not compacted
+
+    - Example
+
+    .. code-block:: JSON
+
+        {
+            "changed": 81236,
+            "documents": 250000,
+            "dry_run": false,
+            "from_version": 1,
+            "seconds": 4.21,
+            "to_version": 3
+        }
+
+    """
+
+    # The lock file is locked by the process using the database, see database
+    with open(path + '.lock', 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise RuntimeError('The database {} is in use, stop the server first'.format(path))
+
+        # The records of the log would be replayed on top of the migrated snapshot
+        log_path = path + '.log'
+        if os.path.exists(log_path) and os.path.getsize(log_path):
+            if not compact_log or dry_run:
+                raise RuntimeError('The log {} holds records that were not compacted, run with --compact-log '
+                                   'to compact it first'.format(log_path))
+
+            storage = LogStorage(path)
+            try:
+                storage.read()
+                storage.compact()
+            finally:
+                storage.close()
+
+        return migrate_snapshot(path, dry_run, report_every)
+
+
+def migrate_snapshot(path, dry_run, report_every):
+    """
+    Apply the migration steps to a database file, see :func:`migrate_file`.
+
+    :param str path: Path of the database file
+    :param bool dry_run: Whether to only count the documents the migration would change, without writing anything
+    :param int report_every: Number of documents between two progress reports
+
+    :returns: Statistics of the migration
+    :rtype: *dict*
+
+    """
+
+    started = time.time()
+    stats = {'from_version': 0, 'to_version': SCHEMA_VERSION, 'documents': 0, 'changed': 0, 'dry_run': dry_run}
+    with open(path) as source:
+        tables = DatabaseReader(source).iter_tables()
+        first_table = next(tables, None)
+        if first_table and first_table[0] == '_meta':
+            for _, meta in first_table[1]:
+                stats['from_version'] = meta.get('schema_version', 0)
+
+            first_table = None
+
+        steps = [step for version, _, step in MIGRATIONS if version > stats['from_version']]
+        if not steps:
+            stats['to_version'] = stats['from_version']
+            stats['seconds'] = time.time() - started
+            return stats
+
+        tmp_path = os.devnull if dry_run else path + '.migration'
+        with open(tmp_path, 'w') as target:
+            target.write('{"_meta": {"1": ' + json.dumps({'schema_version': SCHEMA_VERSION}) + '}')
+            for table_name, documents in chain([first_table] if first_table else [], tables):
+                if table_name == '_meta':
+                    continue
+
+                target.write(', ' + json.dumps(table_name) + ': {')
+                for document_number, (doc_id, document) in enumerate(documents):
+                    changed = False
+                    for step in steps:
+                        changed = step(table_name, document) or changed
+
+                    target.write((', ' if document_number else '') + json.dumps(doc_id) + ': ' + json.dumps(document))
+                    stats['documents'] += 1
+                    stats['changed'] += changed
+                    if stats['documents'] % report_every == 0:
+                        report_progress(stats['documents'], time.time() - started)
+
+                target.write('}')
+
+            target.write('}')
+            if not dry_run:
+                target.flush()
+                os.fsync(target.fileno())
+
+    if not dry_run:
+        os.replace(tmp_path, path)
+
+    stats['seconds'] = time.time() - started
+    return stats
+
+
+def report_progress(documents, seconds):
+    """
+    Report the progress of a migration on the standard error.
+
+    :param int documents: Number of documents migrated so far
+    :param float seconds: Number of seconds since the migration started
+
+    """
+
+    print("{} document(s) in {:.1f}s, {:.0f} document(s)/s".format(documents, seconds, documents / max(seconds, 1e-9)),
+          file=sys.stderr)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Migrate the database file to the latest schema version")
+    parser.add_argument("path", nargs="?", default="db.json", help="Path of the database file")
+    parser.add_argument("--dry-run", action="store_true", help="Only count the documents that would be changed")
+    parser.add_argument("--compact-log", action="store_true", help="Compact the log of the log engine into the database file first")
+    parser.add_argument("--report-every", type=int, default=100000, help="Number of documents between two progress reports")
+    arguments = parser.parse_args()
+
+    size = os.path.getsize(arguments.path)
+    try:
+        stats = migrate_file(arguments.path, arguments.dry_run, arguments.report_every, arguments.compact_log)
+    except RuntimeError as error:
+        sys.exit(str(error))
+
+    if stats['from_version'] == stats['to_version']:
+        print("Database already at schema version {}".format(stats['to_version']))
+    else:
+        print("{} schema version {} to {}: {} of {} document(s) changed in {:.1f}s ({:.0f} document(s)/s, {:.1f} MB/s)"
+              .format("Would migrate" if arguments.dry_run else "Migrated", stats['from_version'], stats['to_version'],
+                      stats['changed'], stats['documents'], stats['seconds'],
+                      stats['documents'] / max(stats['seconds'], 1e-9), size / 1e6 / max(stats['seconds'], 1e-9)))
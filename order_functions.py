@@ -1,15 +1,189 @@
+from bisect import bisect_left
+from collections import defaultdict
 from uuid import uuid4
-from tinydb import TinyDB, Query
-from cart_functions import get_user_cart
+from database import db, orders, flush, transaction, on_reload
+from migrations import orders_to_line_items
+from user_functions import get_user, update_user
+from product_functions import get_products_by_ids, reserve_inventories, release_inventories
 
-orders = TinyDB('db.json').table('orders')
+# Orders table of the database file. When the orders are stored in segments,
+# new orders are staged in it until the transaction storing them is flushed
+stored_orders = db.table('orders')
+order_index = {}
+user_orders = defaultdict(list)
 
 
-def get_order(order_id):
+def build_order_indexes():
+    """
+    Build the index mapping order IDs to the document IDs of the orders in
+    the database, and the index mapping usernames to the document IDs of
+    their orders in ascending order. Orders stored in segments are indexed
+    from the index files of the segments without being loaded.
+
+    :returns: Number of orders indexed
+    :rtype: *int*
+
+    """
+
+    order_index.clear()
+    user_orders.clear()
+    index_entries = getattr(orders, 'index_entries', None)
+    if index_entries:
+        for order_id, uname, doc_id in index_entries():
+            order_index[order_id] = doc_id
+            user_orders[uname].append(doc_id)
+    else:
+        for order in orders:
+            index_order(order, order.doc_id)
+
+    for doc_ids in user_orders.values():
+        doc_ids.sort()
+
+    return len(order_index)
+
+
+def index_order(order, doc_id):
+    """
+    Add an order to the order indexes. Orders have to be indexed in the
+    order in which they were inserted.
+
+    :param dict order: Order
+    :param int doc_id: Document ID of the order
+
+    """
+
+    order_index[order['order_id']] = doc_id
+    user_orders[order['username']].append(doc_id)
+
+
+def migrate_orders():
+    """
+    Convert the orders stored with a copy of each unit of the products
+    purchased, as they were before line items were introduced, to line
+    items, see :func:`migrations.orders_to_line_items`. All the orders are
+    converted in a single update. Orders already stored as line items are
+    left untouched.
+
+    :returns: Number of orders converted
+    :rtype: *int*
+
+    """
+
+    doc_ids = [order.doc_id for order in stored_orders if 'line_items' not in order]
+    if doc_ids:
+        stored_orders.update(lambda order: orders_to_line_items('orders', order), doc_ids=doc_ids)
+        flush()
+
+    return len(doc_ids)
+
+
+def migrate_orders_to_segments():
+    """
+    Move the orders stored in the database file to the order segments, see
+    :mod:`order_segments`, including the orders staged there by a server
+    that stopped before moving them. Does nothing unless the orders are
+    stored in segments. Orders already found in the segments are not stored
+    twice, so an interrupted migration can be run again.
+
+    :returns: Number of orders moved
+    :rtype: *int*
+
+    """
+
+    if orders is stored_orders or not len(stored_orders):
+        return 0
+
+    migrated = 0
+    with transaction():
+        for order in stored_orders:
+            if order['order_id'] not in order_index:
+                index_order(order, orders.insert(dict(order)))
+                migrated += 1
+
+        stored_orders.truncate()
+
+    return migrated
+
+
+def compact_order(uname, order_products, quantities, order_id=None):
+    """
+    Create an order as it is stored in the database, with one line item per
+    product holding its ID, its price at the time of purchase and the
+    quantity purchased. Products missing from *order_products* are left out.
+
+    :param str uname: Username
+    :param dict order_products: IDs of the products purchased mapped to the products
+    :param dict quantities: IDs of the products purchased mapped to the quantity purchased
+    :param str order_id: ID to give to the order, a new one is generated if *None*
+
+    :returns: The order
+    :rtype: *dict*
+
+    - Example
+
+    .. code-block:: JSON
+
+        {
+            "amount": 23.97,
+            "line_items": [
+                {
+                    "price": 7.99,
+                    "product_id": "f4ad5da8-2cc5-4ec0-86f3-4c02367c082f",
+                    "quantity": 3
+                }
+            ],
+            "order_id": "274a5c89-f9ad-4043-a07c-0d545512291b",
+            "username": "Uraraka"
+        }
+
+    """
+
+    line_items = [{'product_id': product_id, 'price': order_products[product_id]['price'], 'quantity': quantity}
+                  for product_id, quantity in quantities.items() if product_id in order_products]
+    return {'order_id': order_id or str(uuid4()), 'username': uname, 'line_items': line_items,
+            'amount': sum(line_item['price'] * line_item['quantity'] for line_item in line_items)}
+
+
+def hydrate_order(order, order_products=None):
+    """
+    Expand the line items of a stored order into the list of the products
+    purchased, one entry per unit, as returned by :func:`get_order`. Each
+    product is shown as it is now, except for its price which is the price
+    it was purchased at. Products deleted since the purchase only have their
+    ID and price. Orders stored before line items were introduced are
+    converted to line items first.
+
+    :param dict order: Order as stored in the database
+    :param dict order_products: IDs of the products purchased mapped to the products, read from the database if *None*
+
+    :returns: The order with its products
+    :rtype: *dict*
+
+    """
+
+    if 'line_items' not in order:
+        order = dict(order)
+        orders_to_line_items('orders', order)
+
+    if order_products is None:
+        order_products = get_products_by_ids([line_item['product_id'] for line_item in order['line_items']])
+
+    products = []
+    for line_item in order['line_items']:
+        product = dict(order_products.get(line_item['product_id'], {'product_id': line_item['product_id']}))
+        product['price'] = line_item['price']
+        products.extend([product] * line_item['quantity'])
+
+    return {'order_id': order['order_id'], 'username': order['username'], 'amount': order['amount'],
+            'products': products}
+
+
+def get_order(order_id, hydrate=True):
     """
     Get order with ID *order_id*.
 
     :param str order_id: ID of the order
+    :param bool hydrate: Whether to return the products purchased instead of the line items stored, see :func:`hydrate_order`
 
     :returns: Order matching ID *order_id*
     :rtype: *dict*
@@ -25,20 +199,20 @@ def get_order(order_id):
                 {
                     "inventory_count": 12,
                     "price": 7.99,
-                    "title": "Orange cupcake",
-                    "uri": "http://localhost:5000/marketplace/api/product/f4ad5da8-2cc5-4ec0-86f3-4c02367c082f"
+                    "product_id": "f4ad5da8-2cc5-4ec0-86f3-4c02367c082f",
+                    "title": "Orange cupcake"
                 },
                 {
                     "inventory_count": 12,
                     "price": 7.99,
-                    "title": "Orange cupcake",
-                    "uri": "http://localhost:5000/marketplace/api/product/f4ad5da8-2cc5-4ec0-86f3-4c02367c082f"
+                    "product_id": "f4ad5da8-2cc5-4ec0-86f3-4c02367c082f",
+                    "title": "Orange cupcake"
                 },
                 {
                     "inventory_count": 12,
                     "price": 7.99,
-                    "title": "Orange cupcake",
-                    "uri": "http://localhost:5000/marketplace/api/product/f4ad5da8-2cc5-4ec0-86f3-4c02367c082f"
+                    "product_id": "f4ad5da8-2cc5-4ec0-86f3-4c02367c082f",
+                    "title": "Orange cupcake"
                 }
             ],
             "username": "Uraraka"
@@ -46,7 +220,43 @@ def get_order(order_id):
 
     """
 
-    return orders.get(Query().order_id == order_id)
+    doc_id = order_index.get(order_id)
+    if doc_id is None:
+        return None
+
+    order = orders.get(doc_id=doc_id)
+    if not hydrate:
+        return order
+
+    return hydrate_order(order)
+
+
+def get_user_orders(uname, limit, cursor=None, hydrate=True):
+    """
+    Get a page of the given user's orders, most recent first.
+
+    :param str uname: Username
+    :param int limit: Maximum number of orders in the page
+    :param int cursor: Cursor returned with the previous page, *None* for the first page
+    :param bool hydrate: Whether to return the products purchased instead of the line items stored, see :func:`hydrate_order`
+
+    :returns: A list containing the orders of the page and the cursor of the next page,
+        which is *None* if there are no orders after this page
+    :rtype: *list*
+
+    """
+
+    doc_ids = user_orders.get(uname, [])
+    end = len(doc_ids) if cursor is None else bisect_left(doc_ids, cursor)
+    page_doc_ids = doc_ids[max(end - limit, 0):end][::-1]
+
+    page = []
+    for doc_id in page_doc_ids:
+        order = orders.get(doc_id=doc_id)
+        page.append(hydrate_order(order) if hydrate else order)
+
+    next_cursor = page_doc_ids[-1] if end > limit else None
+    return [page, next_cursor]
 
 
 def generate_order(uname):
@@ -60,9 +270,119 @@ def generate_order(uname):
 
     """
 
-    user_cart = get_user_cart(uname)
-    order_id = str(uuid4())
-    orders.insert({'order_id': order_id, 'products': user_cart['products'],
-                   'amount': user_cart['total_price'], 'username': uname})
+    quantities = get_user(uname)['cart']
+    order = compact_order(uname, get_products_by_ids(quantities), quantities)
+    with transaction():
+        doc_id = stored_orders.insert(order)
+
+    publish_order(order, doc_id)
+    return order['order_id']
+
+
+def publish_order(order, doc_id):
+    """
+    Index an order once the transaction storing it in the orders table of
+    the database file was flushed. If the orders are stored in segments,
+    the order is moved from the table to the segments first, so that an
+    order only ever reaches the segments once the changes it goes along
+    with are stored. An order left in the table by a server stopped in
+    between is moved on the next startup, see :func:`migrate_orders_to_segments`.
+
+    :param dict order: Order
+    :param int doc_id: Document ID of the order in the orders table of the database file
+
+    """
+
+    if orders is not stored_orders:
+        with transaction():
+            segment_doc_id = orders.insert(dict(order))
+            stored_orders.remove(doc_ids=[doc_id])
+
+        doc_id = segment_doc_id
+
+    index_order(order, doc_id)
+
+
+def checkout(uname, order_id=None, quantities=None):
+    """
+    Complete the given user's cart in one pass. The user and their cart are
+    read once and the inventories of the products in the cart are reserved
+    with :func:`product_functions.reserve_inventories`, which never lets an
+    inventory go negative and does not hold the database lock while it
+    checks them. The new order and the cleared cart are then written as one
+    short transaction. If the cart changed while the inventories were being
+    reserved, for instance because the same cart was being completed
+    concurrently, the reservation is released and nothing is written.
+
+    :param str uname: Username
+    :param str order_id: ID to give to the order, a new one is generated if *None*
+    :param dict quantities: Snapshot of the cart to complete, the current cart is used if *None*
+
+    :returns:
+        - A list containing *0*, the generated order and the products whose inventories were decremented.
+        - A list containing *1* if the user was not found.
+        - A list containing *2* if the user's cart is empty.
+        - A list containing *3* and the IDs of the products whose inventory is too low for the cart.
+        - A list containing *4* if the cart or the products kept changing during the checkout.
+
+    """
+
+    user = get_user(uname)
+    if not user:
+        return [1]
+
+    if quantities is None:
+        quantities = dict(user['cart'])
+
+    if not quantities:
+        return [2]
+
+    reservation = reserve_inventories(quantities)
+    if reservation[0] is None:
+        return [4]
+
+    if not reservation[0]:
+        return [3, reservation[1]]
+
+    affected_products = reservation[1]
+    with transaction():
+        if get_user(uname)['cart'] != quantities:
+            release_inventories(quantities)
+            return [4]
+
+        order_products = {product['product_id']: product for product in affected_products}
+        order = compact_order(uname, order_products, quantities, order_id)
+        doc_id = stored_orders.insert(order)
+        update_user(uname, {'cart': {}})
+
+    publish_order(order, doc_id)
+    return [0, hydrate_order(order, order_products), affected_products]
+
+
+def describe_checkout_failure(outcome):
+    """
+    Describe why a checkout failed.
+
+    :param list outcome: Value returned by :func:`checkout` for a failed checkout
+
+    :returns: A message explaining the failure
+    :rtype: *str*
+
+    """
+
+    if outcome[0] == 1:
+        return "User not found"
+
+    if outcome[0] == 2:
+        return "User's cart is empty"
+
+    if outcome[0] == 3:
+        return "Not enough inventory for product(s): " + ", ".join(outcome[1])
+
+    return "Cart or products changed during checkout, please try again"
+
 
-    return order_id
+migrate_orders()
+build_order_indexes()
+on_reload(build_order_indexes)
+migrate_orders_to_segments()
@@ -0,0 +1,234 @@
+"""
+Segmented storage of the orders.
+
+Orders are only ever added, so instead of living in the database file with
+the users and products they can be stored in a directory of segment files
+holding a fixed number of orders each. New orders are appended to the last
+segment, one JSON line per order, so storing an order costs the same however
+many orders were stored before it. Once a segment is full it is sealed: it
+is never written again and a small index file listing the ID, username and
+document ID of each of its orders is written next to it. A manifest lists
+the segments along with the document ID of their first order.
+
+Sealed segments are only read when one of their orders is requested, and
+only the most recently used ones are kept in memory.
+"""
+
+import json
+import os
+from bisect import bisect_right
+from collections import OrderedDict
+from threading import RLock
+
+
+class SegmentedOrders:
+    """
+    Store the orders in segment files of *segment_size* orders each. Every
+    order gets a document ID, increasing with each order stored, which is
+    used to find the segment holding it.
+    """
+
+    def __init__(self, directory, segment_size, cached_segments=8):
+        """
+        Open the segments, creating the directory and the manifest if needed.
+        The orders of the last segment are loaded, those of the sealed
+        segments are only loaded on demand.
+
+        :param str directory: Path of the directory holding the segments
+        :param int segment_size: Number of orders after which a segment is sealed
+        :param int cached_segments: Maximum number of sealed segments kept in memory
+
+        """
+
+        self._directory = directory
+        self._segment_size = segment_size
+        self._cached_segments = cached_segments
+        self._lock = RLock()
+        self._sealed = OrderedDict()
+        os.makedirs(directory, exist_ok=True)
+
+        self._manifest_path = os.path.join(directory, 'manifest.json')
+        if os.path.exists(self._manifest_path):
+            with open(self._manifest_path) as manifest:
+                self._segments = json.load(manifest)['segments']
+        else:
+            self._segments = []
+
+        self._first_doc_ids = [segment['first_doc_id'] for segment in self._segments]
+        self._active = self._load_active_segment()
+        self._active_file = None
+
+    def insert(self, order):
+        """
+        Append an order to the last segment, sealing it if it is full.
+
+        :param dict order: Order
+
+        :returns: Document ID of the order
+        :rtype: *int*
+
+        """
+
+        with self._lock:
+            if self._segments and not self._segments[-1].get('sealed') and len(self._active) >= self._segment_size:
+                self._seal_segment()
+
+            if not self._segments or self._segments[-1].get('sealed'):
+                self._start_segment()
+
+            if self._active_file is None:
+                self._active_file = open(self._segment_path(self._segments[-1]['name']), 'ab')
+
+            doc_id = self._next_doc_id()
+            self._active_file.write((json.dumps({'doc_id': doc_id, 'order': order}) + '\n').encode('utf-8'))
+            self._active_file.flush()
+            os.fsync(self._active_file.fileno())
+            self._active[doc_id] = order
+
+            if len(self._active) >= self._segment_size:
+                self._seal_segment()
+
+        return doc_id
+
+    def get(self, doc_id):
+        """
+        Get the order with document ID *doc_id*, loading its segment if needed.
+
+        :param int doc_id: Document ID of the order
+
+        :returns: The order, *None* if there is no such order
+        :rtype: *dict*
+
+        """
+
+        with self._lock:
+            position = bisect_right(self._first_doc_ids, doc_id) - 1
+            if position < 0:
+                return None
+
+            if position == len(self._segments) - 1 and not self._segments[position].get('sealed'):
+                return self._active.get(doc_id)
+
+            return self._load_sealed_segment(self._segments[position]['name']).get(doc_id)
+
+    def index_entries(self):
+        """
+        List the ID, username and document ID of every order, in the order
+        they were stored, without loading the sealed segments.
+
+        :returns: A generator of lists containing the order ID, the username and the document ID of an order
+
+        """
+
+        for segment in self._segments:
+            if not segment.get('sealed'):
+                continue
+
+            with open(self._index_path(segment['name'])) as index:
+                for entry in json.load(index):
+                    yield entry
+
+        for doc_id, order in list(self._active.items()):
+            yield [order['order_id'], order['username'], doc_id]
+
+    def close(self):
+        """
+        Close the last segment.
+        """
+
+        with self._lock:
+            if self._active_file:
+                self._active_file.close()
+                self._active_file = None
+
+    def _next_doc_id(self):
+        if self._active:
+            return next(reversed(self._active)) + 1
+
+        if not self._segments:
+            return 1
+
+        last_segment = self._segments[-1]
+        return last_segment['last_doc_id'] + 1 if last_segment.get('sealed') else last_segment['first_doc_id']
+
+    def _start_segment(self):
+        first_doc_id = self._next_doc_id()
+        name = 'orders-{:06d}.jsonl'.format(len(self._segments) + 1)
+        self._segments.append({'name': name, 'first_doc_id': first_doc_id})
+        self._first_doc_ids.append(first_doc_id)
+        self._write_manifest()
+        self._active = OrderedDict()
+
+    def _seal_segment(self):
+        segment = self._segments[-1]
+        entries = [[order['order_id'], order['username'], doc_id] for doc_id, order in self._active.items()]
+        self._write_file(self._index_path(segment['name']), entries)
+
+        segment['last_doc_id'] = next(reversed(self._active))
+        segment['sealed'] = True
+        self._write_manifest()
+        self.close()
+
+        self._sealed[segment['name']] = self._active
+        self._evict_sealed_segments()
+        self._active = OrderedDict()
+
+    def _load_active_segment(self):
+        active = OrderedDict()
+        if not self._segments or self._segments[-1].get('sealed'):
+            return active
+
+        path = self._segment_path(self._segments[-1]['name'])
+        if not os.path.exists(path):
+            return active
+
+        # Drop the tail left by a write interrupted half-way through a line
+        offset = 0
+        with open(path, 'rb+') as segment:
+            for line in segment:
+                try:
+                    record = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    break
+
+                offset += len(line)
+                active[record['doc_id']] = record['order']
+
+            segment.truncate(offset)
+
+        return active
+
+    def _load_sealed_segment(self, name):
+        if name in self._sealed:
+            self._sealed.move_to_end(name)
+            return self._sealed[name]
+
+        with open(self._segment_path(name), 'rb') as segment:
+            records = (json.loads(line.decode('utf-8')) for line in segment)
+            orders = {record['doc_id']: record['order'] for record in records}
+
+        self._sealed[name] = orders
+        self._evict_sealed_segments()
+        return orders
+
+    def _evict_sealed_segments(self):
+        while len(self._sealed) > self._cached_segments:
+            self._sealed.popitem(last=False)
+
+    def _write_manifest(self):
+        self._write_file(self._manifest_path, {'segments': self._segments})
+
+    def _write_file(self, path, content):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as tmp:
+            json.dump(content, tmp)
+            tmp.flush()
+            os.fsync(tmp.fileno())
+
+        os.replace(tmp_path, path)
+
+    def _segment_path(self, name):
+        return os.path.join(self._directory, name)
+
+    def _index_path(self, name):
+        return self._segment_path(name) + '.index'
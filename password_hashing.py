@@ -0,0 +1,212 @@
+"""
+Password hashing. Hashes are deliberately slow to compute and hold the
+interpreter lock while they are computed, so they run in a pool of worker
+processes instead of the request threads, which keep serving the other
+endpoints meanwhile. Only a limited number of hashes can be pending at a
+time, further sign ups and sign ins are rejected straight away instead of
+piling up behind a burst of logins.
+"""
+
+import multiprocessing
+import os
+import socket
+import stat
+import time
+from concurrent.futures import ProcessPoolExecutor
+from threading import BoundedSemaphore, Lock, Thread
+from passlib.apps import custom_app_context
+from passlib.context import CryptContext
+import config
+
+# With MARKETPLACE_HASH_ROUNDS set, every hash computed with another number of
+# rounds is flagged by verify_and_update and replaced on the next sign in
+if config.HASH_ROUNDS:
+    pwd_context = CryptContext(schemes=['sha512_crypt', 'sha256_crypt'], default='sha512_crypt',
+                               **{'{}__{}'.format(scheme, setting): config.HASH_ROUNDS
+                                  for scheme in ('sha512_crypt', 'sha256_crypt')
+                                  for setting in ('default_rounds', 'min_rounds', 'max_rounds')})
+else:
+    pwd_context = custom_app_context
+
+pending_hashes = BoundedSemaphore(config.HASH_QUEUE_SIZE)
+hashing_pool = None
+hashing_pool_lock = Lock()
+
+
+def start_hashing_workers():
+    """
+    Start the pool of worker processes computing the hashes, unless it is
+    already running. The pool is started on the first hash, or by the server
+    before it opens its socket. The workers are always forked, as
+    :func:`watch_server` relies on them being children of the server process.
+
+    :returns: The pool, *None* if the hashes are computed on the request threads
+    :rtype: *ProcessPoolExecutor*
+
+    """
+
+    global hashing_pool
+    if not config.HASH_WORKERS:
+        return None
+
+    with hashing_pool_lock:
+        if hashing_pool is None:
+            hashing_pool = ProcessPoolExecutor(max_workers=config.HASH_WORKERS,
+                                               mp_context=multiprocessing.get_context('fork'),
+                                               initializer=start_worker, initargs=(os.getpid(),))
+            hashing_pool.submit(int).result()
+
+    return hashing_pool
+
+
+def start_worker(server_pid):
+    """
+    Prepare a worker process, see :func:`watch_server` and
+    :func:`close_listening_sockets`. Run by the worker processes when they
+    start.
+
+    :param int server_pid: Process ID of the server
+
+    """
+
+    close_listening_sockets()
+    watch_server(server_pid)
+
+
+def close_listening_sockets():
+    """
+    Close the listening sockets inherited from the server, so that a worker
+    forked after the server opened its socket never keeps the port bound
+    once the server is gone. Nothing is closed on platforms that do not
+    list the open file descriptors in */dev/fd*.
+    """
+
+    try:
+        fds = [int(fd) for fd in os.listdir('/dev/fd')]
+    except OSError:
+        return
+
+    for fd in fds:
+        try:
+            if not stat.S_ISSOCK(os.fstat(fd).st_mode):
+                continue
+
+            sock = socket.socket(fileno=fd)
+        except OSError:
+            continue
+
+        if sock.getsockopt(socket.SOL_SOCKET, socket.SO_ACCEPTCONN):
+            sock.close()
+        else:
+            sock.detach()
+
+
+def watch_server(server_pid):
+    """
+    Exit the worker process once the server process is gone, so that the
+    workers of a killed server do not linger.
+
+    :param int server_pid: Process ID of the server
+
+    """
+
+    def watch():
+        while os.getppid() == server_pid:
+            time.sleep(1)
+
+        os._exit(0)
+
+    Thread(target=watch, daemon=True).start()
+
+
+def hash_password(pwd):
+    """
+    Hash a password.
+
+    :param str pwd: Password
+
+    :returns:
+        - A list containing *0* and the hash.
+        - A list containing *1* if too many hashes are pending.
+
+    """
+
+    return run_in_pool(compute_hash, pwd)
+
+
+def verify_password(pwd, pwd_hash):
+    """
+    Check a password against its hash, and rehash it if the hash was
+    computed with other settings than the current ones.
+
+    :param str pwd: Password
+    :param str pwd_hash: Hash stored for the password
+
+    :returns:
+        - A list containing *0*, whether the password matches and the new hash, which is *None* unless the password matches and has to be rehashed.
+        - A list containing *1* if too many hashes are pending.
+
+    """
+
+    outcome = run_in_pool(compute_verify_and_update, pwd, pwd_hash)
+    if outcome[0] != 0:
+        return outcome
+
+    return [0] + list(outcome[1])
+
+
+def run_in_pool(function, *args):
+    """
+    Run a hashing function in the pool and wait for its result.
+
+    :param function: Function of this module to run
+    :param args: Arguments of the function
+
+    :returns:
+        - A list containing *0* and the value returned by the function.
+        - A list containing *1* if too many hashes are pending.
+
+    """
+
+    if not pending_hashes.acquire(blocking=False):
+        return [1]
+
+    try:
+        pool = start_hashing_workers()
+        if pool is None:
+            return [0, function(*args)]
+
+        return [0, pool.submit(function, *args).result()]
+    finally:
+        pending_hashes.release()
+
+
+def compute_hash(pwd):
+    """
+    Hash a password. Run by the worker processes.
+
+    :param str pwd: Password
+
+    :returns: The hash
+    :rtype: *str*
+
+    """
+
+    return pwd_context.hash(pwd)
+
+
+def compute_verify_and_update(pwd, pwd_hash):
+    """
+    Check a password against its hash and rehash it if needed. Run by the
+    worker processes.
+
+    :param str pwd: Password
+    :param str pwd_hash: Hash stored for the password
+
+    :returns: Whether the password matches and the new hash, *None* if it does not have to be rehashed
+    :rtype: *tuple*
+
+    """
+
+    return pwd_context.verify_and_update(pwd, pwd_hash)
+
@@ -1,10 +1,196 @@
+import json
+from bisect import bisect_right, insort
+from collections import defaultdict
+from threading import Lock
 from uuid import uuid4
-from tinydb import TinyDB, Query
-from tinydb.operations import decrement
-from helper_functions import generate_product_uri, find_func
+from tinydb import Query
+from database import products, flush, transaction, on_reload
+from helper_functions import find_func, title_ngrams
+from migrations import drop_product_uri
+from user_functions import get_user
+
+product_index = {}
+catalog_order = []
+title_index = defaultdict(set)
+# Number of updates of each product's inventory since startup, see compare_and_swap
+product_versions = defaultdict(int)
+# Number of changes to the catalog since startup, see bump_catalog_generation
+catalog_generation = 0
+catalog_generation_lock = Lock()
+
+
+def build_product_index():
+    """
+    Build the index mapping product IDs to the document IDs of the products
+    in the database, and the list of those document IDs in ascending order
+    that the catalog is paged through. Products stored with their URI, as
+    they were before the URI was only generated in the responses, first
+    have the URI dropped and their ID recovered from it if it was not
+    persisted, all in a single update, see :func:`migrations.drop_product_uri`.
+    See :mod:`migrations` to migrate a large database file before startup
+    instead.
+
+    :returns: Number of products indexed
+    :rtype: *int*
+
+    """
+
+    legacy_doc_ids = [product.doc_id for product in products if 'uri' in product]
+    if legacy_doc_ids:
+        products.update(lambda product: drop_product_uri('products', product), doc_ids=legacy_doc_ids)
+        flush()
+
+    product_index.clear()
+    for product in products:
+        product_index[product['product_id']] = product.doc_id
+
+    catalog_order[:] = sorted(product_index.values())
+    return len(product_index)
+
+
+def build_title_index():
+    """
+    Build the inverted index mapping each trigram of the lowercased
+    product titles to the IDs of the products whose title contains it.
+
+    :returns: Number of distinct trigrams indexed
+    :rtype: *int*
+
+    """
+
+    title_index.clear()
+    for product in products:
+        index_title(product['product_id'], product['title'])
+
+    return len(title_index)
+
+
+def index_title(product_id, title):
+    """
+    Add a product's title to the title index.
+
+    :param str product_id: ID of the product
+    :param str title: Title of the product
+
+    """
+
+    for ngram in title_ngrams(title):
+        title_index[ngram].add(product_id)
+
+
+def unindex_title(product_id, title):
+    """
+    Remove a product's title from the title index.
+
+    :param str product_id: ID of the product
+    :param str title: Title of the product
+
+    """
+
+    for ngram in title_ngrams(title):
+        title_index[ngram].discard(product_id)
+        if not title_index[ngram]:
+            del title_index[ngram]
+
+
+def get_catalog_generation():
+    """
+    Get the generation of the catalog, which changes whenever a product is
+    added, deleted or has its inventory updated.
+
+    :returns: Generation of the catalog
+    :rtype: *int*
+
+    """
+
+    return catalog_generation
+
+
+def bump_catalog_generation():
+    """
+    Move the catalog to a new generation. Has to be called after every
+    change to the products, once the change is visible to readers, so that
+    responses computed from the previous generation are not served anymore.
+    """
+
+    global catalog_generation
+    with catalog_generation_lock:
+        catalog_generation += 1
+
+
+def lookup_product(product_id):
+    """
+    Get a single product from the database by its ID regardless of its
+    inventory. Uses the product index instead of scanning the database.
+
+    :param str product_id: ID of the product
+
+    :returns: Product whose ID matches the parameter passed, *None* if not found
+    :rtype: *dict*
+
+    """
+
+    doc_id = product_index.get(product_id)
+    if doc_id is None:
+        return None
+
+    return products.get(doc_id=doc_id)
+
+
+def get_products_by_ids(product_ids):
+    """
+    Get several products from the database by their IDs regardless of their
+    inventory. Every distinct ID is looked up once in the product index, no
+    matter how many times it is repeated.
+
+    :param list product_ids: IDs of the products
+
+    :returns: The IDs of the products found mapped to the products
+    :rtype: *dict*
+
+    """
+
+    found_products = {}
+    for product_id in set(product_ids):
+        product = lookup_product(product_id)
+        if product:
+            found_products[product_id] = product
+
+    return found_products
+
+
+def validate_product(product):
+    """
+    Check that a product sent by a client can be added to the database.
+
+    :param dict product: Product, with its title, price and inventory count
+
+    :returns: Message explaining why the product is invalid, *None* if it is valid
+    :rtype: *str*
+
+    """
+
+    if not isinstance(product, dict):
+        return "Product has to be a JSON object"
+
+    title, price, inventory = product.get('title'), product.get('price'), product.get('inventory_count')
+    if not title:
+        return "Title of product is missing"
+
+    if not isinstance(price, (int, float)):
+        return "Price of product has to be a number"
+
+    if price < 0:
+        return "Price of product has to be non-negative"
+
+    if not isinstance(inventory, int):
+        return "Inventory of product has to be a number"
+
+    if inventory < 0:
+        return "Inventory of product has to be non-negative"
+
+    return None
 
-products = TinyDB('db.json').table('products')
-users = TinyDB('db.json').table('users')
 
 def add_product(title, price, inventory_count):
     """
@@ -19,10 +205,107 @@ def add_product(title, price, inventory_count):
 
     """
 
-    product_id = str(uuid4())
-    products.insert({'title': title, 'price': price, 'inventory_count': inventory_count,
-                     'uri': generate_product_uri(product_id)})
-    return product_id
+    return add_products([{'title': title, 'price': price, 'inventory_count': inventory_count}])[0]
+
+
+def add_products(new_products):
+    """
+    Add several products to database in a single insert.
+
+    :param list new_products: Products to add, each with its title, price and inventory count
+
+    :returns: IDs of the added products, in the same order as the products
+    :rtype: *list*
+
+    """
+
+    documents = []
+    for product in new_products:
+        product_id = str(uuid4())
+        documents.append({'product_id': product_id, 'title': product['title'], 'price': product['price'],
+                          'inventory_count': product['inventory_count']})
+
+    doc_ids = products.insert_multiple(documents)
+    for document, doc_id in zip(documents, doc_ids):
+        product_index[document['product_id']] = doc_id
+        insort(catalog_order, doc_id)
+        index_title(document['product_id'], document['title'])
+
+    bump_catalog_generation()
+    return [document['product_id'] for document in documents]
+
+
+def import_products(lines, batch_size):
+    """
+    Import products from a feed holding one JSON product per line. The
+    products are validated with :func:`validate_product` as they are read,
+    and the valid ones are added and written to disk in batches. Invalid
+    lines are skipped and reported, blank lines are ignored.
+
+    :param lines: Iterable of the lines of the feed, as *str* or *bytes*
+    :param int batch_size: Number of products added and written at once
+
+    :returns: A list containing the number of products imported and the errors found, one per invalid line
+    :rtype: *list*
+
+    - Example
+
+    .. code-block:: JSON
+
+        [
+            2,
+            [
+                {
+                    "line": 2,
+                    "message": "Price of product has to be a number"
+                }
+            ]
+        ]
+
+    """
+
+    imported = 0
+    errors = []
+    batch = []
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+
+        try:
+            product = json.loads(line)
+        except ValueError:
+            errors.append({'line': line_number, 'message': "Line is not valid JSON"})
+            continue
+
+        error_msg = validate_product(product)
+        if error_msg:
+            errors.append({'line': line_number, 'message': error_msg})
+            continue
+
+        batch.append(product)
+        if len(batch) >= batch_size:
+            imported += add_product_batch(batch)
+            batch = []
+
+    if batch:
+        imported += add_product_batch(batch)
+
+    return [imported, errors]
+
+
+def add_product_batch(batch):
+    """
+    Add a batch of products to database and write them to disk as one transaction.
+
+    :param list batch: Products to add, each with its title, price and inventory count
+
+    :returns: Number of products added
+    :rtype: *int*
+
+    """
+
+    with transaction():
+        return len(add_products(batch))
 
 
 def get_all_products():
@@ -39,14 +322,14 @@ def get_all_products():
             {
                 "inventory_count": 18,
                 "price": 15.65,
-                "title": "Mango pizza",
-                "uri": "http://localhost:5000/marketplace/api/product/84a1c5d6-d1fd-4db0-bc1e-f450a70ca7d9"
+                "product_id": "84a1c5d6-d1fd-4db0-bc1e-f450a70ca7d9",
+                "title": "Mango pizza"
             },
             {
                 "inventory_count": 51,
                 "price": 4.99,
-                "title": "Guava cupcake",
-                "uri": "http://localhost:5000/marketplace/api/product/a37b3418-cc8f-40fa-8d63-661b3912eb71"
+                "product_id": "a37b3418-cc8f-40fa-8d63-661b3912eb71",
+                "title": "Guava cupcake"
             }
         ]
 
@@ -56,6 +339,71 @@ def get_all_products():
     return products.search(Product_query.inventory_count > 0)
 
 
+def iter_products():
+    """
+    Generate the products in the database with inventory greater than zero
+    one at a time, in the order in which they were added, without building
+    the list of all the products.
+
+    :returns: A generator of products
+
+    """
+
+    position = 0
+    while position < len(catalog_order):
+        product = products.get(doc_id=catalog_order[position])
+        position += 1
+        if product and product['inventory_count'] > 0:
+            yield product
+
+
+def get_products_page(limit, cursor=None):
+    """
+    Get a page of the products in the database with inventory greater than zero.
+    Products are ordered by the order in which they were added, and only the
+    products of the requested page are read from the database.
+
+    :param int limit: Maximum number of products in the page
+    :param int cursor: Cursor returned with the previous page, *None* for the first page
+
+    :returns: A list containing the products of the page and the cursor of the next page,
+        which is *None* if there are no products after this page
+    :rtype: *list*
+
+    - Example
+
+    .. code-block:: JSON
+
+        [
+            [
+                {
+                    "inventory_count": 18,
+                    "price": 15.65,
+                    "product_id": "84a1c5d6-d1fd-4db0-bc1e-f450a70ca7d9",
+                    "title": "Mango pizza"
+                }
+            ],
+            12
+        ]
+
+    """
+
+    page = []
+    position = 0 if cursor is None else bisect_right(catalog_order, cursor)
+    while position < len(catalog_order):
+        product = products.get(doc_id=catalog_order[position])
+        position += 1
+        if not product or product['inventory_count'] <= 0:
+            continue
+
+        if len(page) == limit:
+            return [page, page[-1].doc_id]
+
+        page.append(product)
+
+    return [page, None]
+
+
 def get_product(product_id):
     """
     Get a single product from the database by its ID. Only returns product if it
@@ -73,20 +421,63 @@ def get_product(product_id):
             {
                 "inventory_count": 51,
                 "price": 4.99,
-                "title": "Guava cupcake",
-                "uri": "http://localhost:5000/marketplace/api/product/a37b3418-cc8f-40fa-8d63-661b3912eb71"
+                "product_id": "a37b3418-cc8f-40fa-8d63-661b3912eb71",
+                "title": "Guava cupcake"
             }
     """
 
-    Product_query = Query()
-    return products.get((Product_query.uri == generate_product_uri(product_id))
-                        & (Product_query.inventory_count > 0))
+    product = lookup_product(product_id)
+    if not product or product['inventory_count'] <= 0:
+        return None
+
+    return product
+
+
+def get_products(product_ids):
+    """
+    Get several products from the database by their IDs, in one pass over
+    the product index. Like :func:`get_product`, only returns the products
+    that have inventory greater than zero.
+
+    :param list product_ids: IDs of the products
+
+    :returns: A list containing the IDs of the products found mapped to the products,
+        and the IDs of the products not found or out of stock, in the order they were passed
+    :rtype: *list*
+
+    - Example
+
+    .. code-block:: JSON
+
+        [
+            {
+                "a37b3418-cc8f-40fa-8d63-661b3912eb71": {
+                    "inventory_count": 51,
+                    "price": 4.99,
+                    "product_id": "a37b3418-cc8f-40fa-8d63-661b3912eb71",
+                    "title": "Guava cupcake"
+                }
+            },
+            [
+                "84a1c5d6-d1fd-4db0-bc1e-f450a70ca7d9"
+            ]
+        ]
+
+    """
+
+    found_products = get_products_by_ids(product_ids)
+    in_stock = {product_id: product for product_id, product in found_products.items()
+                if product['inventory_count'] > 0}
+    missing = [product_id for product_id in dict.fromkeys(product_ids) if product_id not in in_stock]
+    return [in_stock, missing]
 
 
 def find_products(search_title):
     """
     Find products in the database whose title match *search_title* at least partially.
     Performs case-insensitive search. Only returns products with inventory greater than zero.
+    Search titles of at least three characters are answered from the title index, shorter
+    ones are checked against every product.
 
     :param str search_title: Title to search products by
 
@@ -100,21 +491,48 @@ def find_products(search_title):
             {
                 "inventory_count": 51,
                 "price": 4.99,
-                "title": "Guava cupcake",
-                "uri": "http://localhost:5000/marketplace/api/product/a37b3418-cc8f-40fa-8d63-661b3912eb71"
+                "product_id": "a37b3418-cc8f-40fa-8d63-661b3912eb71",
+                "title": "Guava cupcake"
             },
             {
                 "inventory_count": 12,
                 "price": 7.99,
-                "title": "Orange cupcake",
-                "uri": "http://localhost:5000/marketplace/api/product/f4ad5da8-2cc5-4ec0-86f3-4c02367c082f"
+                "product_id": "f4ad5da8-2cc5-4ec0-86f3-4c02367c082f",
+                "title": "Orange cupcake"
             }
         ]
     """
 
-    Product_query = Query()
-    return products.search((Product_query.title.test(find_func, search_title))
-                           & (Product_query.inventory_count > 0))
+    return list(iter_find_products(search_title))
+
+
+def iter_find_products(search_title):
+    """
+    Generate the products that :func:`find_products` returns one at a time,
+    without building the list of all the matching products.
+
+    :param str search_title: Title to search products by
+
+    :returns: A generator of the products whose titles match the search title at least partially
+
+    """
+
+    search_ngrams = title_ngrams(search_title)
+    if not search_ngrams:
+        for product in products:
+            if product['inventory_count'] > 0 and find_func(product['title'], search_title):
+                yield product
+
+        return
+
+    # Only products whose title has every trigram of the search title can match
+    postings = sorted((title_index.get(ngram, set()) for ngram in search_ngrams), key=len)
+    candidate_ids = postings[0].intersection(*postings[1:])
+
+    for product_id in sorted(candidate_ids, key=product_index.get):
+        product = lookup_product(product_id)
+        if product and product['inventory_count'] > 0 and find_func(product['title'], search_title):
+            yield product
 
 
 def delete_product(product_id):
@@ -129,12 +547,16 @@ def delete_product(product_id):
 
     """
 
-    Product_query = Query()
-    prod_to_delete = products.get(Product_query.uri == generate_product_uri(product_id))
+    prod_to_delete = lookup_product(product_id)
     if not prod_to_delete:
         return [False]
 
     products.remove(doc_ids=[prod_to_delete.doc_id])
+    del product_index[product_id]
+    del catalog_order[bisect_right(catalog_order, prod_to_delete.doc_id) - 1]
+    unindex_title(product_id, prod_to_delete['title'])
+    product_versions.pop(product_id, None)
+    bump_catalog_generation()
     return [True, prod_to_delete]
 
 
@@ -155,27 +577,150 @@ def decrement_inventories(uname):
             {
                 "inventory_count": 51,
                 "price": 4.99,
-                "title": "Guava cupcake",
-                "uri": "http://localhost:5000/marketplace/api/product/a37b3418-cc8f-40fa-8d63-661b3912eb71"
+                "product_id": "a37b3418-cc8f-40fa-8d63-661b3912eb71",
+                "title": "Guava cupcake"
             },
             {
                 "inventory_count": 12,
                 "price": 7.99,
-                "title": "Orange cupcake",
-                "uri": "http://localhost:5000/marketplace/api/product/f4ad5da8-2cc5-4ec0-86f3-4c02367c082f"
+                "product_id": "f4ad5da8-2cc5-4ec0-86f3-4c02367c082f",
+                "title": "Orange cupcake"
             }
         ]
 
     """
 
-    User_query = Query()
-    Product_query = Query()
-    current_user_cart = users.get(User_query.username == uname)['cart']
+    return decrement_product_inventories(get_user(uname)['cart'])
+
+
+def decrement_product_inventories(quantities):
+    """
+    Decrement the inventories of several products in a single update of
+    the database. Products that are not in the database anymore are skipped.
+
+    :param dict quantities: IDs of the products mapped to the quantity to decrement their inventory by
+
+    :returns: A list of the products whose inventories were decreased, as updated
+
+    """
+
     affected_products = []
-    for product_id in current_user_cart:
-        products.update(decrement('inventory_count'), Product_query.uri == generate_product_uri(product_id))
 
-    for product_id in set(current_user_cart):
-        affected_products.append(products.get(Product_query.uri == generate_product_uri(product_id)))
+    def decrement_inventory(product):
+        product['inventory_count'] -= quantities[product['product_id']]
+        product_versions[product['product_id']] += 1
+        affected_products.append(dict(product))
 
+    products.update(decrement_inventory, doc_ids=[product_index[product_id] for product_id in quantities
+                                                  if product_id in product_index])
+    bump_catalog_generation()
     return affected_products
+
+
+def invalidate_product_versions():
+    """
+    Move every product that had its inventory updated to a new version, so
+    that no compare and swap computed from a version read before the
+    database was read again can succeed.
+    """
+
+    for product_id in list(product_versions):
+        product_versions[product_id] += 1
+
+
+def compare_and_swap(expected_versions, quantities):
+    """
+    Decrement the inventories of several products only if none of them was
+    updated since their versions were read. All the versions are checked
+    before any inventory is decremented, within a single update of the
+    database, so no other update of the products can slip in between.
+
+    :param dict expected_versions: IDs of the products mapped to the version the quantities were checked against
+    :param dict quantities: IDs of the products mapped to the quantity to decrement their inventory by
+
+    :returns: A list of the products whose inventories were decreased, as updated, *None* if any of the products changed in the meantime
+    :rtype: *list*
+
+    """
+
+    doc_ids = [product_index.get(product_id) for product_id in quantities]
+    if None in doc_ids:
+        return None
+
+    versions_match = []
+    swapped_products = []
+
+    def swap(product):
+        if not versions_match:
+            versions_match.append(all(product_versions[product_id] == version
+                                      for product_id, version in expected_versions.items()))
+
+        if versions_match[0]:
+            product['inventory_count'] -= quantities[product['product_id']]
+            product_versions[product['product_id']] += 1
+            swapped_products.append(dict(product))
+
+    products.update(swap, doc_ids=doc_ids)
+    if not swapped_products:
+        return None
+
+    bump_catalog_generation()
+    return swapped_products
+
+
+def reserve_inventories(quantities, attempts=3):
+    """
+    Decrement the inventories of several products without ever letting an
+    inventory go negative, even when other checkouts reserve the same
+    products concurrently, and without holding the database lock while the
+    inventories are checked. The inventories are checked against the
+    versions of the products, then all decremented at once with
+    :func:`compare_and_swap`, which is retried up to *attempts* times if any
+    of the products keeps changing.
+
+    :param dict quantities: IDs of the products mapped to the quantity to reserve
+    :param int attempts: Number of times to try reserving the products
+
+    :returns:
+        - A list containing *True* and the products whose inventories were decremented, as updated.
+        - A list containing *False* and the IDs of the products whose inventory is too low or that were not found.
+        - A list containing *None* if the products kept changing.
+
+    """
+
+    for _ in range(attempts):
+        # The versions have to be read before the products, so that any
+        # change made after the products were read makes the swap fail
+        expected_versions = {product_id: product_versions[product_id] for product_id in quantities}
+        current_products = get_products_by_ids(quantities)
+        short_product_ids = [product_id for product_id, quantity in quantities.items()
+                             if product_id not in current_products
+                             or current_products[product_id]['inventory_count'] < quantity]
+        if short_product_ids:
+            return [False, short_product_ids]
+
+        reserved_products = compare_and_swap(expected_versions, quantities)
+        if reserved_products is not None:
+            return [True, reserved_products]
+
+    return [None]
+
+
+def release_inventories(quantities):
+    """
+    Give back inventory reserved with :func:`reserve_inventories`.
+
+    :param dict quantities: IDs of the products mapped to the quantity to give back
+
+    :returns: A list of the products whose inventories were increased, as updated
+
+    """
+
+    return decrement_product_inventories({product_id: -quantity for product_id, quantity in quantities.items()})
+
+build_product_index()
+build_title_index()
+on_reload(build_product_index)
+on_reload(build_title_index)
+on_reload(bump_catalog_generation)
+on_reload(invalidate_product_versions)
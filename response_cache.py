@@ -0,0 +1,95 @@
+"""
+Cache of the responses of the catalog endpoints. A response is cached
+along with a strong ETag computed from its body, under the endpoint, the
+arguments of the request and the generation of the catalog it was
+computed from. Any change to the catalog moves it to a new generation,
+see :func:`product_functions.bump_catalog_generation`, so responses
+computed before the change are never served again and age out of the
+cache. Clients sending back the ETag of the current response in
+*If-None-Match* get an empty 304 (Not modified) response.
+"""
+
+from collections import OrderedDict
+from functools import wraps
+from hashlib import sha256
+from threading import Lock
+from flask import request, make_response
+import config
+from product_functions import get_catalog_generation
+
+# Cache keys mapped to the body, mimetype and ETag of the responses, least recently used first
+cached_responses = OrderedDict()
+cached_responses_lock = Lock()
+
+
+def cache_response(view):
+    """
+    Decorate an endpoint so that its successful responses are cached and
+    served with an ETag. Error responses and streamed responses are
+    returned as they are.
+
+    :param view: Function of the endpoint
+
+    :returns: The decorated function
+
+    """
+
+    @wraps(view)
+    def cached_view(**kwargs):
+        # The generation is read before the response is computed, so that a
+        # response racing with a change to the catalog is cached under the
+        # generation that the change replaces
+        key = (request.endpoint, request.host_url, tuple(sorted(kwargs.items())),
+               tuple(sorted(request.args.items(multi=True))), get_catalog_generation())
+        entry = get_cached_response(key)
+        if entry is None:
+            response = make_response(view(**kwargs))
+            if response.status_code != 200 or response.is_streamed:
+                return response
+
+            body = response.get_data()
+            entry = (body, response.mimetype, sha256(body).hexdigest())
+            cache_response_entry(key, entry)
+
+        body, mimetype, etag = entry
+        response = make_response(body)
+        response.mimetype = mimetype
+        response.set_etag(etag)
+        return response.make_conditional(request)
+
+    return cached_view
+
+
+def get_cached_response(key):
+    """
+    Get a response from the cache.
+
+    :param tuple key: Cache key of the response
+
+    :returns: The body, mimetype and ETag of the response, *None* if it is not cached
+    :rtype: *tuple*
+
+    """
+
+    with cached_responses_lock:
+        entry = cached_responses.get(key)
+        if entry is not None:
+            cached_responses.move_to_end(key)
+
+    return entry
+
+
+def cache_response_entry(key, entry):
+    """
+    Add a response to the cache, evicting the least recently used responses
+    if the cache is full.
+
+    :param tuple key: Cache key of the response
+    :param tuple entry: Body, mimetype and ETag of the response
+
+    """
+
+    with cached_responses_lock:
+        cached_responses[key] = entry
+        while len(cached_responses) > config.RESPONSE_CACHE_SIZE:
+            cached_responses.popitem(last=False)
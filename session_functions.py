@@ -0,0 +1,84 @@
+"""
+Session tokens. A token is issued on sign in and sent back with later
+requests instead of the password, so that authenticating a request never
+involves hashing. Tokens are signed, and the ones seen recently are kept in
+an in-memory cache so that checking them again is a single lookup.
+"""
+
+import time
+from collections import OrderedDict
+from threading import Lock
+from uuid import uuid4
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+import config
+
+serializer = URLSafeTimedSerializer(config.SECRET_KEY, salt='marketplace-session')
+# Tokens mapped to their username and expiry time, least recently used first
+active_sessions = OrderedDict()
+sessions_lock = Lock()
+
+
+def create_session(uname):
+    """
+    Issue a session token for a user who just signed in.
+
+    :param str uname: Username
+
+    :returns: The session token
+    :rtype: *str*
+
+    """
+
+    token = serializer.dumps({'username': uname, 'session_id': str(uuid4())})
+    cache_session(token, uname, time.time() + config.SESSION_TTL)
+    return token
+
+
+def get_session_user(token):
+    """
+    Get the user a session token was issued to. The token is looked up in
+    the cache of active sessions first, and its signature is only checked
+    if it is not cached.
+
+    :param str token: Session token
+
+    :returns: Username, *None* if the token is invalid or expired
+    :rtype: *str*
+
+    """
+
+    with sessions_lock:
+        session = active_sessions.get(token)
+        if session and session[1] > time.time():
+            active_sessions.move_to_end(token)
+            return session[0]
+
+        if session:
+            del active_sessions[token]
+            return None
+
+    try:
+        payload, signed_at = serializer.loads(token, max_age=config.SESSION_TTL, return_timestamp=True)
+    except BadSignature:
+        return None
+
+    cache_session(token, payload['username'], signed_at.timestamp() + config.SESSION_TTL)
+    return payload['username']
+
+
+def cache_session(token, uname, expires_at):
+    """
+    Add a session to the cache of active sessions, evicting the least
+    recently used sessions if the cache is full.
+
+    :param str token: Session token
+    :param str uname: Username
+    :param float expires_at: Time at which the session expires, in seconds since the epoch
+
+    """
+
+    with sessions_lock:
+        active_sessions[token] = (uname, expires_at)
+        active_sessions.move_to_end(token)
+        while len(active_sessions) > config.SESSION_CACHE_SIZE:
+            active_sessions.popitem(last=False)
@@ -0,0 +1,120 @@
+"""
+SQLite storage for TinyDB.
+
+Every TinyDB table is stored in an SQLite table of the same name holding one
+row per document. Each write only inserts, replaces or deletes the rows of
+the documents modified since the previous write, inside a single transaction,
+so the changes made while handling a request are stored atomically. A write
+breaking the uniqueness of an indexed field is rolled back as a whole. The
+database runs in WAL mode so that other processes can read it while the
+server writes.
+"""
+
+import json
+import sqlite3
+from incremental_storage import IncrementalStorage, ConflictError
+
+
+class SQLiteStorage(IncrementalStorage):
+    """
+    Store the data in an SQLite database, one row per document.
+    """
+
+    def __init__(self, path, unique_fields=None):
+        """
+        Open the SQLite database, creating it if needed.
+
+        :param str path: Path of the SQLite database file
+        :param dict unique_fields: Table names mapped to the document fields that have to be unique in that table. A unique index is created for every such field.
+
+        """
+
+        super().__init__()
+        self._unique_fields = unique_fields or {}
+        self._created_tables = set()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+
+    def read(self):
+        """
+        Read every document of every table.
+
+        :returns: The database contents, *None* if the database is empty
+        :rtype: *dict*
+
+        """
+
+        data = {}
+        for table_name in self._table_names():
+            rows = self._connection.execute('SELECT doc_id, document FROM "{}"'.format(table_name))
+            data[table_name] = {doc_id: json.loads(document) for doc_id, document in rows}
+
+        return data or None
+
+    def write(self, data):
+        """
+        Store the documents marked as modified in a single transaction.
+        If no document was marked as modified, all the tables are rewritten.
+
+        :param dict data: The database contents
+
+        :raises ConflictError: If a document breaks the uniqueness of one of the *unique_fields*
+
+        """
+
+        dirty = self.pop_dirty()
+        if not dirty:
+            dirty = dict.fromkeys(set(data) | set(self._table_names()))
+
+        cursor = self._connection.cursor()
+        cursor.execute('BEGIN')
+        try:
+            for table_name, doc_ids in dirty.items():
+                table = data.get(table_name) or {}
+                self._create_table(cursor, table_name)
+                if doc_ids is None:
+                    cursor.execute('DELETE FROM "{}"'.format(table_name))
+                    doc_ids = table.keys()
+
+                for doc_id in doc_ids:
+                    if doc_id in table:
+                        # Only replace the row of the same document, a conflict on a unique field has to raise
+                        cursor.execute('INSERT INTO "{}" (doc_id, document) VALUES (?, ?) '
+                                       'ON CONFLICT(doc_id) DO UPDATE SET document = excluded.document'
+                                       .format(table_name), (doc_id, json.dumps(table[doc_id])))
+                    else:
+                        cursor.execute('DELETE FROM "{}" WHERE doc_id = ?'.format(table_name), (doc_id,))
+
+            cursor.execute('COMMIT')
+        except sqlite3.IntegrityError as error:
+            cursor.execute('ROLLBACK')
+            self._created_tables.clear()
+            raise ConflictError(str(error)) from error
+        except Exception:
+            cursor.execute('ROLLBACK')
+            self._created_tables.clear()
+            raise
+
+    def close(self):
+        """
+        Close the SQLite database.
+        """
+
+        self._connection.close()
+
+    def _table_names(self):
+        rows = self._connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        return [name for name, in rows]
+
+    def _create_table(self, cursor, table_name):
+        if table_name in self._created_tables:
+            return
+
+        cursor.execute('CREATE TABLE IF NOT EXISTS "{}" (doc_id TEXT PRIMARY KEY, document TEXT NOT NULL)'
+                       .format(table_name))
+        for field in self._unique_fields.get(table_name, []):
+            cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS "{0}_{1}" ON "{0}" (json_extract(document, \'$.{1}\'))'
+                           .format(table_name, field))
+
+        self._created_tables.add(table_name)
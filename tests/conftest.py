@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The storage and migration tests import the modules of the service directly
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
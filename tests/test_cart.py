@@ -0,0 +1,116 @@
+import requests
+TEST_PRODUCT_BODY = {}
+cart_url = "http://localhost:5000/marketplace/api/"
+
+
+def test_add_product():
+    body = {
+	"title": "Lemon tart",
+	"price": 3.25,
+	"inventory_count": 40
+    }
+    r = requests.post(cart_url + "add-product", json=body)
+    global TEST_PRODUCT_BODY
+    TEST_PRODUCT_BODY = r.json()['added_product']
+    assert r.status_code == 201
+
+def test_add_same_product_to_cart_twice():
+    body = {
+        "username": "Abhijay",
+        "product_id": TEST_PRODUCT_BODY['product_id']
+    }
+    for _ in range(2):
+        r = requests.post(cart_url + "add-product-to-cart", json=body)
+        assert r.status_code == 200
+
+def test_get_user_cart():
+    r = requests.post(cart_url + "get-user-cart", json={"username": "Abhijay"})
+    assert r.status_code == 200
+    assert r.json()['user_cart']['products'].count(TEST_PRODUCT_BODY) == 2
+    assert r.json()['user_cart']['total_price'] >= 2 * TEST_PRODUCT_BODY['price']
+
+def test_remove_products_from_cart():
+    body = {
+        "username": "Abhijay",
+        "product_id": TEST_PRODUCT_BODY['product_id']
+    }
+    for _ in range(2):
+        r = requests.delete(cart_url + "remove-product-from-cart", json=body)
+        assert r.status_code == 200
+    r = requests.delete(cart_url + "remove-product-from-cart", json=body)
+    assert r.status_code == 404
+    assert r.json()['message'] == "Product not in cart anymore"
+
+def test_add_quantity_to_cart():
+    body = {
+        "username": "Abhijay",
+        "product_id": TEST_PRODUCT_BODY['product_id'],
+        "quantity": 3
+    }
+    r = requests.post(cart_url + "add-product-to-cart", json=body)
+    assert r.status_code == 200
+    assert r.json()['added_product_to_cart']['quantity'] == 3
+    r = requests.post(cart_url + "get-user-cart", json={"username": "Abhijay"})
+    assert r.json()['user_cart']['products'].count(TEST_PRODUCT_BODY) == 3
+
+def test_invalid_quantity():
+    body = {
+        "username": "Abhijay",
+        "product_id": TEST_PRODUCT_BODY['product_id'],
+        "quantity": 0
+    }
+    r = requests.post(cart_url + "add-product-to-cart", json=body)
+    assert r.status_code == 400
+    assert r.json()['message'] == "Quantity has to be a positive number"
+
+def test_remove_more_than_in_cart():
+    body = {
+        "username": "Abhijay",
+        "product_id": TEST_PRODUCT_BODY['product_id'],
+        "quantity": 5
+    }
+    r = requests.delete(cart_url + "remove-product-from-cart", json=body)
+    assert r.status_code == 200
+    assert r.json()['removed_product_from_cart']['quantity'] == 3
+    r = requests.post(cart_url + "get-user-cart", json={"username": "Abhijay"})
+    assert TEST_PRODUCT_BODY not in r.json()['user_cart']['products']
+
+def test_update_cart_in_bulk():
+    product_id = TEST_PRODUCT_BODY['product_id']
+    body = {
+        "username": "Abhijay",
+        "operations": [
+            {"op": "add", "product_id": product_id, "quantity": 4},
+            {"op": "remove", "product_id": product_id}
+        ]
+    }
+    r = requests.post(cart_url + "update-cart", json=body)
+    assert r.status_code == 200
+    assert r.json()['user_cart']['products'].count(TEST_PRODUCT_BODY) == 3
+    body['operations'] = [{"op": "remove", "product_id": product_id, "quantity": 10}]
+    r = requests.post(cart_url + "update-cart", json=body)
+    assert r.status_code == 200
+    assert TEST_PRODUCT_BODY not in r.json()['user_cart']['products']
+
+def test_update_cart_invalid_operation():
+    body = {
+        "username": "Abhijay",
+        "operations": [
+            {"op": "add", "product_id": TEST_PRODUCT_BODY['product_id']},
+            {"op": "add", "product_id": TEST_PRODUCT_BODY['product_id'], "quantity": -1}
+        ]
+    }
+    r = requests.post(cart_url + "update-cart", json=body)
+    assert r.status_code == 400
+    assert r.json()['message'] == "Operation 2: Quantity has to be a positive number"
+    r = requests.post(cart_url + "get-user-cart", json={"username": "Abhijay"})
+    assert TEST_PRODUCT_BODY not in r.json()['user_cart']['products']
+
+def test_get_user_cart_with_session_token():
+    token = requests.post(cart_url + "sign-in", json={"username": "Abhijay", "password": "a123"}).json()['token']
+    r = requests.post(cart_url + "get-user-cart", json={"username": "Abhijay"}, headers={"Authorization": "Bearer " + token})
+    assert r.status_code == 200
+    r = requests.post(cart_url + "get-user-cart", json={"username": "Uraraka"}, headers={"Authorization": "Bearer " + token})
+    assert r.status_code == 403
+    r = requests.post(cart_url + "get-user-cart", json={"username": "Abhijay"}, headers={"Authorization": "Bearer " + token + "x"})
+    assert r.status_code == 401
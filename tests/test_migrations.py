@@ -0,0 +1,98 @@
+import io
+import json
+import pytest
+from migrations import DatabaseReader, migrate_file, SCHEMA_VERSION
+
+DATABASE = {
+    "users": {
+        "1": {"username": "Abhijay", "cart": ["p1", "p1", "p2"], "email": "a@aj.com"},
+        "2": {"username": "Uraraka", "cart": [], "email": "u\"r@aj.com"}
+    },
+    "empty": {},
+    "products": {
+        "10": {"title": "Peach cobbler", "price": 6.5, "inventory_count": 123456789,
+               "uri": "http://localhost:5000/marketplace/api/product/p1"}
+    },
+    "orders": {
+        "1": {"order_id": "o1", "username": "Abhijay", "amount": 13.0,
+              "products": [{"product_id": "p1", "price": 6.5}, {"product_id": "p1", "price": 6.5}]}
+    }
+}
+
+
+def read_database(text, chunk_size):
+    return {table_name: dict(documents)
+            for table_name, documents in DatabaseReader(io.StringIO(text), chunk_size).iter_tables()}
+
+def write_database(path, data):
+    with open(path, 'w') as database:
+        json.dump(data, database)
+
+def test_reader_at_every_chunk_size():
+    text = json.dumps(DATABASE, indent=1)
+    for chunk_size in range(1, len(text) + 2):
+        assert read_database(text, chunk_size) == DATABASE
+
+def test_reader_number_split_across_chunks():
+    text = '{"t": {"1": 1234567, "2": 0.125, "3": -2.5E+10}}'
+    for chunk_size in range(1, 12):
+        assert read_database(text, chunk_size) == {"t": {"1": 1234567, "2": 0.125, "3": -2.5e10}}
+
+def test_reader_empty_database():
+    assert read_database('', 1) == {}
+    assert read_database(' {} ', 1) == {}
+
+def test_reader_invalid_database():
+    with pytest.raises(ValueError):
+        read_database('{"t": {"1": 1}]', 2)
+
+def test_migrate_twice(tmp_path):
+    path = str(tmp_path / 'db.json')
+    write_database(path, DATABASE)
+
+    stats = migrate_file(path)
+    assert stats['from_version'] == 0
+    assert stats['to_version'] == SCHEMA_VERSION
+    assert stats['documents'] == 4
+    assert stats['changed'] == 4
+
+    with open(path) as database:
+        migrated = json.load(database)
+    assert list(migrated)[0] == '_meta'
+    assert migrated['_meta']['1']['schema_version'] == SCHEMA_VERSION
+    assert migrated['users']['1']['cart'] == {"p1": 2, "p2": 1}
+    assert migrated['users']['2']['cart'] == {}
+    assert 'uri' not in migrated['products']['10']
+    assert migrated['products']['10']['product_id'] == "p1"
+    assert migrated['orders']['1']['line_items'] == [{"product_id": "p1", "price": 6.5, "quantity": 2}]
+    assert migrated['empty'] == {}
+
+    stats = migrate_file(path)
+    assert stats['from_version'] == SCHEMA_VERSION
+    assert stats['to_version'] == SCHEMA_VERSION
+    assert stats['documents'] == 0
+    with open(path) as database:
+        assert json.load(database) == migrated
+
+def test_migrate_dry_run(tmp_path):
+    path = str(tmp_path / 'db.json')
+    write_database(path, DATABASE)
+    stats = migrate_file(path, dry_run=True)
+    assert stats['changed'] == 4
+    with open(path) as database:
+        assert json.load(database) == DATABASE
+
+def test_migrate_refuses_uncompacted_log(tmp_path):
+    path = str(tmp_path / 'db.json')
+    write_database(path, DATABASE)
+    with open(path + '.log', 'w') as log:
+        log.write(json.dumps({"table": "users", "doc_id": "3", "document": {"username": "Midoriya", "cart": ["p2"]}}) + '\n')
+        log.write(json.dumps({"commit": 1}) + '\n')
+
+    with pytest.raises(RuntimeError):
+        migrate_file(path)
+
+    migrate_file(path, compact_log=True)
+    with open(path) as database:
+        assert json.load(database)['users']['3']['cart'] == {"p2": 1}
+    assert open(path + '.log').read() == ''
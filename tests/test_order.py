@@ -0,0 +1,132 @@
+import time
+from uuid import uuid4
+import requests
+TEST_PRODUCT_BODY = {}
+TEST_ORDER = {}
+ASYNC_ORDER_ID = ""
+api_url = "http://localhost:5000/marketplace/api/"
+
+
+def test_add_product():
+    body = {
+	"title": "Peach cobbler",
+	"price": 6.5,
+	"inventory_count": 10
+    }
+    r = requests.post(api_url + "add-product", json=body)
+    global TEST_PRODUCT_BODY
+    TEST_PRODUCT_BODY = r.json()['added_product']
+    assert r.status_code == 201
+
+def test_complete_cart():
+    body = {
+        "username": "Abhijay",
+        "product_id": TEST_PRODUCT_BODY['product_id'],
+        "quantity": 3
+    }
+    requests.post(api_url + "add-product-to-cart", json=body)
+    r = requests.post(api_url + "complete-cart", json={"username": "Abhijay"})
+    global TEST_ORDER
+    TEST_ORDER = r.json()['order']
+    assert r.status_code == 200
+    affected_product = [product for product in r.json()['affected_products'] if product['product_id'] == TEST_PRODUCT_BODY['product_id']][0]
+    assert affected_product['inventory_count'] == 7
+    assert len([product for product in TEST_ORDER['products'] if product['product_id'] == TEST_PRODUCT_BODY['product_id']]) == 3
+    assert TEST_ORDER['username'] == "Abhijay"
+
+def test_cart_cleared_after_completion():
+    r = requests.post(api_url + "get-user-cart", json={"username": "Abhijay"})
+    assert r.json()['user_cart']['products'] == []
+
+def test_complete_empty_cart():
+    r = requests.post(api_url + "complete-cart", json={"username": "Abhijay"})
+    assert r.status_code == 404
+    assert r.json()['message'] == "User's cart is empty"
+
+def test_get_order():
+    r = requests.get(api_url + "order/" + TEST_ORDER['order_id'])
+    assert r.status_code == 200
+    assert r.json()['order'] == TEST_ORDER
+
+def test_get_order_line_items():
+    r = requests.get(api_url + "order/" + TEST_ORDER['order_id'], params={"hydrate": "false"})
+    assert r.status_code == 200
+    assert r.json()['order']['line_items'] == [{"product_id": TEST_PRODUCT_BODY['product_id'], "price": TEST_PRODUCT_BODY['price'], "quantity": 3}]
+    assert r.json()['order']['amount'] == TEST_ORDER['amount']
+
+def test_get_non_existing_order():
+    r = requests.get(api_url + "order/gibberish")
+    assert r.status_code == 404
+    assert r.json()['message'] == "Order not found"
+
+def test_complete_cart_not_enough_inventory():
+    body = {
+        "username": "Abhijay",
+        "product_id": TEST_PRODUCT_BODY['product_id'],
+        "quantity": 8
+    }
+    requests.post(api_url + "add-product-to-cart", json=body)
+    r = requests.post(api_url + "complete-cart", json={"username": "Abhijay"})
+    assert r.status_code == 409
+    r = requests.get(TEST_PRODUCT_BODY['uri'])
+    assert r.json()['product']['inventory_count'] == 7
+    r = requests.delete(api_url + "remove-product-from-cart", json=body)
+    assert r.json()['removed_product_from_cart']['quantity'] == 8
+
+def test_complete_cart_asynchronously():
+    body = {
+        "username": "Abhijay",
+        "product_id": TEST_PRODUCT_BODY['product_id'],
+        "quantity": 2
+    }
+    requests.post(api_url + "add-product-to-cart", json=body)
+    r = requests.post(api_url + "complete-cart?async=true", json={"username": "Abhijay"})
+    assert r.status_code == 202
+    assert r.json()['status'] == "pending"
+    order_id = r.json()['order_id']
+    for _ in range(50):
+        status = requests.get(api_url + "order/" + order_id + "/status").json()['status']
+        if status not in ("pending", "processing"):
+            break
+        time.sleep(0.1)
+    assert status == "completed"
+    r = requests.get(api_url + "order/" + order_id)
+    assert r.json()['order']['amount'] == 2 * TEST_PRODUCT_BODY['price']
+    global ASYNC_ORDER_ID
+    ASYNC_ORDER_ID = order_id
+
+def test_order_status_with_session_token():
+    username = "Status-" + str(uuid4())
+    requests.post(api_url + "sign-up", json={"username": username, "password": "a123", "email": username + "@st.com"})
+    other_token = requests.post(api_url + "sign-in", json={"username": username, "password": "a123"}).json()['token']
+    token = requests.post(api_url + "sign-in", json={"username": "Abhijay", "password": "a123"}).json()['token']
+    status_url = api_url + "order/" + ASYNC_ORDER_ID + "/status"
+    assert requests.get(status_url, headers={"Authorization": "Bearer " + token}).status_code == 200
+    assert requests.get(status_url, headers={"Authorization": "Bearer " + other_token}).status_code == 403
+    assert requests.get(status_url, headers={"Authorization": "Bearer " + token + "x"}).status_code == 401
+
+def test_non_existing_order_with_session_token():
+    token = requests.post(api_url + "sign-in", json={"username": "Abhijay", "password": "a123"}).json()['token']
+    for url in (api_url + "order/gibberish", api_url + "order/gibberish/status"):
+        assert requests.get(url, headers={"Authorization": "Bearer " + token}).status_code == 403
+        assert requests.get(url, headers={"Authorization": "Bearer " + token + "x"}).status_code == 401
+
+def test_non_existing_order_status():
+    r = requests.get(api_url + "order/gibberish/status")
+    assert r.status_code == 404
+    assert r.json()['message'] == "Order not found"
+
+def test_get_user_orders_in_pages():
+    r = requests.get(api_url + "orders", params={"username": "Abhijay", "limit": 1})
+    assert r.status_code == 200
+    assert len(r.json()['orders']) == 1
+    latest_order = r.json()['orders'][0]
+    r = requests.get(api_url + "orders", params={"username": "Abhijay", "limit": 1, "cursor": r.json()['next_cursor']})
+    assert r.status_code == 200
+    assert r.json()['orders'][0]['order_id'] != latest_order['order_id']
+    assert TEST_ORDER['order_id'] in [order['order_id'] for order in r.json()['orders']]
+
+def test_get_orders_of_non_existing_user():
+    r = requests.get(api_url + "orders", params={"username": "Alakazam"})
+    assert r.status_code == 404
+    assert r.json()['message'] == "User not found"
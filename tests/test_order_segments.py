@@ -0,0 +1,50 @@
+import os
+from order_segments import SegmentedOrders
+
+
+def make_order(number):
+    return {"order_id": "o" + str(number), "username": "Abhijay" if number % 2 else "Uraraka", "amount": number}
+
+def test_segments_sealed_and_reopened(tmp_path):
+    directory = str(tmp_path / 'orders')
+    orders = SegmentedOrders(directory, segment_size=2, cached_segments=1)
+    assert [orders.insert(make_order(number)) for number in range(1, 6)] == [1, 2, 3, 4, 5]
+    orders.close()
+    assert sorted(os.listdir(directory)) == ['manifest.json', 'orders-000001.jsonl', 'orders-000001.jsonl.index',
+                                             'orders-000002.jsonl', 'orders-000002.jsonl.index', 'orders-000003.jsonl']
+
+    orders = SegmentedOrders(directory, segment_size=2, cached_segments=1)
+    for number in range(1, 6):
+        assert orders.get(number) == make_order(number)
+    assert orders.get(0) is None
+    assert orders.get(6) is None
+    assert list(orders.index_entries()) == [[make_order(number)["order_id"], make_order(number)["username"], number]
+                                            for number in range(1, 6)]
+    assert orders.insert(make_order(6)) == 6
+    assert orders.insert(make_order(7)) == 7
+    assert orders.get(6) == make_order(6)
+    orders.close()
+
+def test_segments_drop_interrupted_write(tmp_path):
+    directory = str(tmp_path / 'orders')
+    orders = SegmentedOrders(directory, segment_size=3)
+    orders.insert(make_order(1))
+    orders.insert(make_order(2))
+    orders.close()
+
+    segment_path = os.path.join(directory, 'orders-000001.jsonl')
+    committed_size = os.path.getsize(segment_path)
+    with open(segment_path, 'a') as segment:
+        segment.write('{"doc_id": 3, "order": {"order_')
+
+    orders = SegmentedOrders(directory, segment_size=3)
+    assert os.path.getsize(segment_path) == committed_size
+    assert orders.get(2) == make_order(2)
+    assert orders.get(3) is None
+    assert orders.insert(make_order(3)) == 3
+    orders.close()
+
+    orders = SegmentedOrders(directory, segment_size=3)
+    assert [entry[2] for entry in orders.index_entries()] == [1, 2, 3]
+    assert orders.get(3) == make_order(3)
+    orders.close()
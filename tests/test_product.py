@@ -67,6 +67,25 @@ def test_add_product():
     TEST_PRODUCT_URI = r.json()['added_product']['uri']
     TEST_PRODUCT_BODY = r.json()['added_product']
     assert r.status_code == 201
+    assert TEST_PRODUCT_BODY['product_id'] == TEST_PRODUCT_URI.split("/")[-1]
+
+def test_import_products():
+    feed = "\n".join([
+        json.dumps({"title": "Pistachio macaron", "price": 1.75, "inventory_count": 80}),
+        json.dumps({"title": "Hazelnut macaron", "price": "1.75", "inventory_count": 80}),
+        "{not json",
+        json.dumps({"title": "Raspberry macaron", "price": 1.75, "inventory_count": 80}),
+    ])
+    r = requests.post("http://localhost:5000/marketplace/api/import-products", data=feed,
+                      headers={"Content-Type": "application/x-ndjson"})
+    assert r.status_code == 200
+    assert r.json()['imported'] == 2
+    assert r.json()['errors'] == [{"line": 2, "message": "Price of product has to be a number"},
+                                  {"line": 3, "message": "Line is not valid JSON"}]
+    r = requests.get("http://localhost:5000/marketplace/api/find-products/macaron")
+    titles = [product['title'] for product in r.json()['products']]
+    assert "Pistachio macaron" in titles and "Raspberry macaron" in titles
+    assert "Hazelnut macaron" not in titles
 
 def test_get_one_product():
     global TEST_PRODUCT_BODY
@@ -77,12 +96,60 @@ def test_get_one_product():
     assert r.json()['product']['title'] == TEST_PRODUCT_BODY['title']
     assert r.json()['product']['price'] == TEST_PRODUCT_BODY['price']
 
+def test_get_product_not_modified():
+    r = requests.get(TEST_PRODUCT_URI)
+    assert r.headers['ETag']
+    r = requests.get(TEST_PRODUCT_URI, headers={"If-None-Match": r.headers['ETag']})
+    assert r.status_code == 304
+
+def test_get_all_products_modified_after_change():
+    etag = requests.get("http://localhost:5000/marketplace/api/products").headers['ETag']
+    requests.post(product_url, json={"title": "Banana bread", "price": 4.5, "inventory_count": 7})
+    r = requests.get("http://localhost:5000/marketplace/api/products", headers={"If-None-Match": etag})
+    assert r.status_code == 200
+    assert "Banana bread" in [product['title'] for product in r.json()['products']]
+
+def test_get_products_batch():
+    body = {"product_ids": [TEST_PRODUCT_BODY['product_id'], "non-existing-product"]}
+    r = requests.post("http://localhost:5000/marketplace/api/products/batch", json=body)
+    assert r.status_code == 200
+    assert r.json()['products'] == {TEST_PRODUCT_BODY['product_id']: TEST_PRODUCT_BODY}
+    assert r.json()['missing'] == ["non-existing-product"]
+
+def test_get_products_batch_invalid_ids():
+    r = requests.post("http://localhost:5000/marketplace/api/products/batch", json={"product_ids": "abc"})
+    assert r.status_code == 400
+
 def test_get_all_products():
     r = requests.get("http://localhost:5000/marketplace/api/products")
     assert r.status_code == 200
     assert r.json()['products']
     assert len(r.json()['products']) >= 1 #checking that there are at least one or more products
 
+def test_get_products_in_pages():
+    all_products = requests.get("http://localhost:5000/marketplace/api/products").json()['products']
+    paged_products = []
+    params = {"limit": 1}
+    while True:
+        r = requests.get("http://localhost:5000/marketplace/api/products", params=params)
+        assert r.status_code == 200
+        assert len(r.json()['products']) == 1
+        paged_products += r.json()['products']
+        if not r.json()['next_cursor']:
+            break
+        params['cursor'] = r.json()['next_cursor']
+    assert paged_products == all_products
+
+def test_stream_all_products():
+    all_products = requests.get("http://localhost:5000/marketplace/api/products").json()['products']
+    r = requests.get("http://localhost:5000/marketplace/api/products", params={"stream": "true"})
+    assert r.status_code == 200
+    assert r.json()['products'] == all_products
+
+def test_get_products_invalid_limit():
+    r = requests.get("http://localhost:5000/marketplace/api/products", params={"limit": 0})
+    assert r.status_code == 400
+
 def test_existing_product():
     r = requests.get(TEST_PRODUCT_URI)
     assert r.status_code == 200
@@ -99,6 +166,21 @@ def test_find_existing_products():
     assert r.json()['products']
     assert len(r.json()['products']) >= 1
 
+def test_find_products_partial_title():
+    r = requests.get("http://localhost:5000/marketplace/api/find-products/" + TEST_PRODUCT_BODY['title'][1:-1].swapcase())
+    assert r.status_code == 200
+    assert TEST_PRODUCT_BODY in r.json()['products']
+
+def test_stream_found_products():
+    r = requests.get("http://localhost:5000/marketplace/api/find-products/" + TEST_PRODUCT_BODY['title'], params={"stream": "true"})
+    assert r.status_code == 200
+    assert TEST_PRODUCT_BODY in r.json()['products']
+
+def test_stream_non_existing_products():
+    r = requests.get("http://localhost:5000/marketplace/api/find-products/Orrangeee", params={"stream": "true"})
+    assert r.status_code == 404
+    assert r.json()['message'] == "Product(s) not found"
+
 def test_find_non_existing_products():
     r = requests.get("http://localhost:5000/marketplace/api/find-products/Orrangeee")
     assert r.status_code == 404
@@ -23,4 +23,12 @@ def test_incorrect_password():
 	"password": "sfa23"
     }   
     r = requests.post(url, json=body)
-    assert r.json()['message'] == "Incorrect password"
\ No newline at end of file
+    assert r.json()['message'] == "Incorrect password"
+
+def test_login_returns_session_token():
+    body = {
+	"username": "Abhijay",
+	"password": "a123"
+    }
+    r = requests.post(url, json=body)
+    assert r.json()['token']
@@ -1,3 +1,5 @@
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
 import requests
 url = "http://localhost:5000/marketplace/api/sign-up"
 
@@ -44,4 +46,13 @@ def test_email_already_registered():
 	"email": "a@aj.com"
     }
     r = requests.post(url, json=body)
-    assert r.json()['message'] == "Email already registered"
\ No newline at end of file
+    assert r.json()['message'] == "Email already registered"
+
+def test_concurrent_sign_ups_with_same_username():
+    username = "Concurrent-" + str(uuid4())
+    bodies = [{"username": username, "password": "52tfsfa24t", "email": "{}@{}.com".format(i, username)}
+              for i in range(4)]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        responses = list(executor.map(lambda body: requests.post(url, json=body), bodies))
+
+    assert sorted(r.status_code for r in responses) == [201, 400, 400, 400]
@@ -0,0 +1,125 @@
+import json
+import pytest
+from incremental_storage import ConflictError
+from log_storage import LogStorage
+from sqlite_storage import SQLiteStorage
+
+
+def write_documents(storage, data, table_name, doc_ids):
+    storage.mark_dirty(table_name, doc_ids)
+    storage.write(data)
+
+def crash(storage):
+    # Release the lock of the log without compacting it, as a killed process would
+    storage._log.close()
+
+def test_log_storage_replays_committed_records(tmp_path):
+    path = str(tmp_path / 'db.json')
+    storage = LogStorage(path)
+    assert storage.read() is None
+    data = {"users": {"1": {"username": "Abhijay"}}}
+    write_documents(storage, data, "users", [1])
+    data["users"]["2"] = {"username": "Uraraka"}
+    del data["users"]["1"]
+    write_documents(storage, data, "users", [1, 2])
+    crash(storage)
+
+    storage = LogStorage(path)
+    assert storage.read() == {"users": {"2": {"username": "Uraraka"}}}
+    crash(storage)
+
+def test_log_storage_discards_uncommitted_tail(tmp_path):
+    path = str(tmp_path / 'db.json')
+    storage = LogStorage(path)
+    storage.read()
+    write_documents(storage, {"users": {"1": {"username": "Abhijay"}}}, "users", [1])
+    crash(storage)
+
+    committed_size = len(open(path + '.log', 'rb').read())
+    with open(path + '.log', 'a') as log:
+        log.write(json.dumps({"table": "users", "doc_id": "2", "document": {"username": "Uraraka"}}) + '\n')
+        log.write('{"table": "users", "doc_')
+
+    storage = LogStorage(path)
+    assert storage.read() == {"users": {"1": {"username": "Abhijay"}}}
+    assert len(open(path + '.log', 'rb').read()) == committed_size
+    write_documents(storage, {"users": {"1": {"username": "Abhijay"}, "3": {"username": "Midoriya"}}}, "users", [3])
+    crash(storage)
+
+    storage = LogStorage(path)
+    assert storage.read() == {"users": {"1": {"username": "Abhijay"}, "3": {"username": "Midoriya"}}}
+    crash(storage)
+
+def test_log_storage_compacts_on_close(tmp_path):
+    path = str(tmp_path / 'db.json')
+    storage = LogStorage(path)
+    storage.read()
+    write_documents(storage, {"users": {"1": {"username": "Abhijay"}}}, "users", [1])
+    storage.close()
+
+    assert open(path + '.log').read() == ''
+    with open(path) as snapshot:
+        assert json.load(snapshot) == {"users": {"1": {"username": "Abhijay"}}}
+
+def test_log_storage_compacts_after_limit(tmp_path):
+    path = str(tmp_path / 'db.json')
+    storage = LogStorage(path, compact_after=2)
+    storage.read()
+    data = {"users": {}}
+    for doc_id in range(1, 4):
+        data["users"][str(doc_id)] = {"username": "User" + str(doc_id)}
+        write_documents(storage, data, "users", [doc_id])
+    crash(storage)
+
+    with open(path) as snapshot:
+        assert len(json.load(snapshot)["users"]) == 2
+    storage = LogStorage(path)
+    assert storage.read() == data
+    crash(storage)
+
+def test_log_storage_open_once(tmp_path):
+    path = str(tmp_path / 'db.json')
+    storage = LogStorage(path)
+    with pytest.raises(RuntimeError):
+        LogStorage(path)
+    storage.close()
+
+def test_sqlite_storage_stores_modified_documents(tmp_path):
+    path = str(tmp_path / 'db.sqlite3')
+    storage = SQLiteStorage(path)
+    assert storage.read() is None
+    data = {"users": {"1": {"username": "Abhijay"}, "2": {"username": "Uraraka"}}}
+    write_documents(storage, data, "users", [1, 2])
+    data["users"]["1"]["cart"] = {"p1": 2}
+    del data["users"]["2"]
+    write_documents(storage, data, "users", [1, 2])
+    storage.close()
+
+    storage = SQLiteStorage(path)
+    assert storage.read() == {"users": {"1": {"username": "Abhijay", "cart": {"p1": 2}}}}
+    storage.close()
+
+def test_sqlite_storage_rewrites_tables_without_dirty_documents(tmp_path):
+    path = str(tmp_path / 'db.sqlite3')
+    storage = SQLiteStorage(path)
+    write_documents(storage, {"users": {"1": {"username": "Abhijay"}}}, "users", [1])
+    storage.write({"products": {"1": {"title": "Peach cobbler"}}})
+    assert storage.read() == {"users": {}, "products": {"1": {"title": "Peach cobbler"}}}
+    storage.close()
+
+def test_sqlite_storage_unique_fields(tmp_path):
+    path = str(tmp_path / 'db.sqlite3')
+    storage = SQLiteStorage(path, unique_fields={"users": ["email"]})
+    data = {"users": {"1": {"username": "Abhijay", "email": "a@aj.com"}}}
+    write_documents(storage, data, "users", [1])
+    data["users"]["1"]["email"] = "b@aj.com"
+    write_documents(storage, data, "users", [1])
+
+    conflicting = {"users": {"1": data["users"]["1"], "2": {"username": "Uraraka", "email": "b@aj.com"}},
+                   "products": {"1": {"title": "Peach cobbler"}}}
+    storage.mark_dirty("products", [1])
+    with pytest.raises(ConflictError):
+        write_documents(storage, conflicting, "users", [2])
+
+    assert storage.read() == {"users": {"1": {"username": "Abhijay", "email": "b@aj.com"}}}
+    storage.close()
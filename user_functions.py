@@ -1,27 +1,100 @@
-from tinydb import TinyDB, Query
-from passlib.apps import custom_app_context as pwd_context
+from database import lock, users, on_reload
+from password_hashing import hash_password, verify_password
+
+username_index = {}
+email_index = {}
+
+
+def build_user_indexes():
+    """
+    Build the indexes mapping usernames and emails to the document IDs
+    of the users in the database.
+
+    :returns: Number of users indexed
+    :rtype: *int*
+
+    """
+
+    username_index.clear()
+    email_index.clear()
+    for user in users:
+        username_index[user['username']] = user.doc_id
+        email_index[user['email']] = user.doc_id
+
+    return len(username_index)
+
+
+def lookup_user(uname):
+    """
+    Retrieve the full database document of a user, password hash included,
+    based on their username. Uses the username index instead of scanning
+    the database.
+
+    :param str uname: Username
+
+    :returns: User whose username matches the passed parameter, *None* if not found
+    :rtype: *dict*
+
+    """
+
+    doc_id = username_index.get(uname)
+    if doc_id is None:
+        return None
+
+    return users.get(doc_id=doc_id)
+
+
+def update_user(uname, fields):
+    """
+    Update a user's document.
+
+    :param str uname: Username
+    :param fields: Fields to set on the user's document, or a function modifying the document in place
+
+    """
+
+    users.update(fields, doc_ids=[username_index[uname]])
 
-users = TinyDB('db.json').table('users')
 
 def sign_up(uname, pwd, email):
     """
-    Sign up a new user to the database.
+    Sign up a new user to the database. The password is hashed first, and
+    the username and email are checked again just before the user is
+    inserted, so that concurrent sign ups can never both claim them.
 
     :param str uname: Username (has to be unique)
     :param str pwd: Password
     :param str email: Email (has to be unique)
 
-    :returns: Username of the new user
-    :rtype: *str*
+    :returns:
+        * 0 - successful sign up.
+        * 1 - username already being used.
+        * 2 - email already registered.
+        * 3 - too many passwords are being hashed.
 
     """
-    users.insert({'username': uname, 'password': pwd_context.encrypt(pwd), 'email': email, 'cart': []})
-    return uname
+    hashed = hash_password(pwd)
+    if hashed[0] != 0:
+        return 3
+
+    with lock:
+        if uname in username_index:
+            return 1
+
+        if email in email_index:
+            return 2
+
+        doc_id = users.insert({'username': uname, 'password': hashed[1], 'email': email, 'cart': {}})
+        username_index[uname] = doc_id
+        email_index[email] = doc_id
+
+    return 0
 
 
 def sign_in(uname, pwd):
     """
-    Perform sign in of a user.
+    Perform sign in of a user. If the password hash was computed with other
+    settings than the current ones, the password is rehashed.
 
     :param str uname: Username
     :param str pwd: Password
@@ -30,16 +103,23 @@ def sign_in(uname, pwd):
         * 0 - successful login.
         * 1 - user not found.
         * 2 - incorrect password.
+        * 3 - too many passwords are being hashed.
 
     """
-    User_query = Query()
-    found_user = users.get(User_query.username == uname)
+    found_user = lookup_user(uname)
     if not found_user:
         return 1
 
-    if not pwd_context.verify(pwd, found_user['password']):
+    verified = verify_password(pwd, found_user['password'])
+    if verified[0] != 0:
+        return 3
+
+    if not verified[1]:
         return 2
 
+    if verified[2]:
+        update_user(uname, {'password': verified[2]})
+
     return 0
 
 
@@ -59,15 +139,14 @@ def get_user(uname):
         {
             "username": "johndoe",
             "email": "johndoe@email.com"
-            "cart": [
-                "63f6-bj6m-345k",
-                "354g-3427-nb38"
-            ]
+            "cart": {
+                "63f6-bj6m-345k": 1,
+                "354g-3427-nb38": 2
+            }
         }
 
     """
-    User_query = Query()
-    user = users.get(User_query.username == uname)
+    user = lookup_user(uname)
     if user:
         user.pop('password')
 
@@ -90,16 +169,23 @@ def get_user_by_email(email):
         {
             "username": "johndoe",
             "email": "johndoe@email.com"
-            "cart": [
-                "63f6-bj6m-345k",
-                "354g-3427-nb38"
-            ]
+            "cart": {
+                "63f6-bj6m-345k": 1,
+                "354g-3427-nb38": 2
+            }
         }
 
     """
-    User_query = Query()
-    user = users.get(User_query.email == email)
+    doc_id = email_index.get(email)
+    if doc_id is None:
+        return None
+
+    user = users.get(doc_id=doc_id)
     if user:
         user.pop('password')
 
     return user
+
+
+build_user_indexes()
+on_reload(build_user_indexes)